@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""decode time and peak memory of game responses, the stdlib path against ztransport.loads
+
+payloads come from a zreplay session (initGame, dealto and getWarResult records) or are synthetic
+
+    python bench/bench_decode.py
+    python bench/bench_decode.py --session session.jsonl.gz"""
+import argparse
+import json
+import random
+import tracemalloc
+
+import common
+import zemulator
+import zmetrics
+import zreplay
+import ztransport
+
+ENDPOINTS = ('/api/initGame', '/pve/dealto', '/pve/getWarResult')
+
+
+def synthetic_payloads(ships):
+    dock = common.dock(ships)
+    rnd = random.Random(2)
+    init_game = {'userShipVO': dock,
+                 'fleetVo': [{'id': i, 'ships': [s['id'] for s in dock[i * 6:i * 6 + 6]], 'status': 0} for i in range(8)],
+                 'pveExploreVo': {'levels': []}, 'repairDockVo': [], 'dockVo': [], 'equipmentDockVo': [],
+                 'equipmentVo': [{'equipmentCid': 10000021 + i * 100, 'num': rnd.randint(0, 9)} for i in range(400)],
+                 'unlockShip': [s['shipCid'] for s in dock], 'unlockEquipment': list(range(400)),
+                 'taskVo': [{'taskCid': 5200000 + i, 'condition': [{'totalAmount': 3, 'finishedAmount': 1}]}
+                            for i in range(60)],
+                 'userVo': {'detailInfo': {'shipNumTop': ships + 50}},
+                 'marketingData': {'isSpoilsShopEvent': 0, 'continueLoginAward': {'canGetDay': -1}}}
+    fleet = dock[:6]
+    report = {'hpBeforeNightWarEnemy': [rnd.randint(0, 90) for _ in range(6)],
+              'selfShips': fleet, 'enemyShips': common.dock(6, seed=3),
+              'attacks': [{'from': rnd.randint(0, 11), 'to': rnd.randint(0, 11), 'damage': rnd.randint(0, 200)}
+                          for _ in range(120)]}
+    war_result = {'warResult': {'resultLevel': 1, 'selfShipResults': [{'hasLevelUp': 0} for _ in fleet]},
+                  'shipVO': fleet, 'extraProgress': {}, 'newShipVO': common.dock(1, seed=4)}
+    return [('/api/initGame', init_game), ('/pve/dealto', {'warReport': report, 'shipVO': fleet}),
+            ('/pve/getWarResult', war_result)]
+
+
+def recorded_payloads(session):
+    """the largest recorded body of every measured endpoint"""
+    best = {}
+    for record in zreplay.load_session(session):
+        path = zmetrics.endpoint_template(record['url'])
+        endpoint = next((e for e in ENDPOINTS if path.startswith(e)), None)
+        if endpoint and record['body'] is not None:
+            size = len(json.dumps(record['body']))
+            if endpoint not in best or size > best[endpoint][0]:
+                best[endpoint] = (size, record['body'])
+    return [(endpoint, best[endpoint][1]) for endpoint in ENDPOINTS if endpoint in best]
+
+
+def stdlib_loads(content):
+    """what r.json() did before ztransport.loads"""
+    return json.loads(content.decode('utf-8'))
+
+
+def peak(func, content):
+    tracemalloc.start()
+    func(content)
+    peak_size = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak_size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--session', help='zreplay session file or archive directory')
+    parser.add_argument('--ships', type=int, default=1000, help='ships of the synthetic initGame')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--number', type=int, default=10)
+    args = parser.parse_args()
+
+    with common.SyntheticInitData():
+        payloads = recorded_payloads(args.session) if args.session else synthetic_payloads(args.ships)
+        print('ztransport.loads uses {}'.format('orjson' if ztransport.orjson else 'the stdlib, orjson is not installed'))
+        for endpoint, body in payloads:
+            content = json.dumps(body, ensure_ascii=False).encode('utf-8')
+            print('{} {:.0f} KB'.format(endpoint, len(content) / 1024))
+            for name, func in (('stdlib json', stdlib_loads), ('ztransport.loads', ztransport.loads)):
+                best, _ = common.timed(lambda: func(content), args.repeat, args.number)
+                print('    {:<18} {:>10}   peak {:.2f} MiB'.format(name, common.ms(best), peak(func, content) / 2 ** 20))
+
+        # initGame里的船只列表复制进userShip之后就被丢掉, 不再存两份
+        init_game = dict(payloads).get('/api/initGame')
+        if init_game and 'userShipVO' in init_game:
+            emulator = zemulator.ZjsnEmulator()
+            content = json.dumps(init_game).encode('utf-8')
+            tracemalloc.start()
+            emulator.initGame = ztransport.loads(content)
+            emulator.load_init_game(emulator.initGame)
+            kept = tracemalloc.get_traced_memory()[0]
+            emulator.prune_init_game()
+            pruned = tracemalloc.get_traced_memory()[0]
+            tracemalloc.stop()
+            print('initGame and userShip after login {:.2f} MiB, {:.2f} MiB once initGame drops the ship list'.format(
+                kept / 2 ** 20, pruned / 2 ** 20))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""startup cost of InitData: a cold load parses init.txt, a warm load reads init.cache
+
+    python bench/bench_init_cache.py                  # synthetic init.txt
+    python bench/bench_init_cache.py --init init.txt  # a real getInitConfigs dump"""
+import argparse
+import os
+import shutil
+import tempfile
+
+import common
+import zemulator
+
+
+def new_init_data(directory, init_file):
+    data = zemulator.InitData()
+    data.init_file_path = init_file
+    data.init_file_path_japan = os.path.join(directory, "init_japan.txt")
+    data.cache_file_path = os.path.join(directory, "init.cache")
+    data.trans_table_path = os.path.join(directory, "trans_table.json")
+    return data
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--init", help="init.txt to load, a synthetic one is written when missing")
+    parser.add_argument("--cards", type=int, default=3000, help="ship cards of the synthetic init.txt")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix="zjsn_bench_")
+    try:
+        init_file = os.path.join(directory, "init.txt")
+        if args.init:
+            shutil.copyfile(args.init, init_file)
+        else:
+            common.write_init_file(init_file, cards=args.cards)
+        cache_file = os.path.join(directory, "init.cache")
+
+        def cold():
+            if os.path.exists(cache_file):
+                os.remove(cache_file)
+            new_init_data(directory, init_file).load()
+
+        def warm():
+            new_init_data(directory, init_file).load()
+
+        cold_best, cold_median = common.timed(cold, args.repeat)
+        cold()  # 留下缓存给warm用
+        warm_best, warm_median = common.timed(warm, args.repeat)
+        data = new_init_data(directory, init_file)
+        print("init.txt {:.1f} MB, {} ship cards, init.cache {:.1f} MB".format(
+            os.path.getsize(init_file) / 2 ** 20, len(data.ship_card), os.path.getsize(cache_file) / 2 ** 20))
+        print("cold json load   best {}  median {}".format(common.ms(cold_best), common.ms(cold_median)))
+        print("warm cache load  best {}  median {}".format(common.ms(warm_best), common.ms(warm_median)))
+        print("speedup {:.1f}x".format(cold_median / warm_median))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
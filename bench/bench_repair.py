@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""simulation of repair_all over synthetic damage: how long until ship_groups can fill the fleet again
+
+the old queue repairs the shortest job first, repair_queue puts the ships ship_groups wait for first.
+both are played through repair_plan with the same docks, instant repairs use instant_repair_choice
+
+    python bench/bench_repair.py --trials 200 --docks 4 --candidates 8"""
+import argparse
+import random
+import statistics
+
+import common
+import zemulator
+
+# 破损分布 -> 一条船受伤的概率, 剩余血量比例的范围
+DISTRIBUTIONS = {'light': (0.5, (0.3, 0.95)),
+                 'uniform': (0.7, (0.05, 0.99)),
+                 'heavy': (0.9, (0.05, 0.5))}
+
+
+def damage(dock, distribution, rnd):
+    chance, (low, high) = DISTRIBUTIONS[distribution]
+    for vo in dock:
+        vo['isLocked'] = 1
+        hp_max = vo['battlePropsMax']['hp']
+        vo['battleProps']['hp'] = max(1, int(hp_max * rnd.uniform(low, high))) if rnd.random() < chance else hp_max
+
+
+def fleet_ready_time(emulator, plan, groups, instant=()):
+    """seconds until every group has enough usable ships, inf when it never has"""
+    end = dict(plan)
+    end.update((ship_id, 0) for ship_id in instant)
+    worst = 0
+    for group, need, b_level in groups:
+        ready = []
+        for ship in emulator.userShip.select(group):
+            if not (ship.locked and ship.fleet_able):
+                continue
+            if ship.status != 2 and not ship.should_be_repair(b_level) or ship.id in instant:
+                ready.append(0)
+            elif ship.id in end:
+                ready.append(end[ship.id])
+        ready.sort()
+        worst = max(worst, ready[need - 1] if len(ready) >= need else float('inf'))
+    return worst
+
+
+def summary(values):
+    finite = sorted(v for v in values if v != float('inf'))
+    if not finite:
+        return 'never ready'
+    return 'median {:6.2f} h   p90 {:6.2f} h   never ready {}'.format(
+        statistics.median(finite) / 3600, finite[int(len(finite) * 0.9)] / 3600 if len(finite) > 1 else finite[0] / 3600,
+        len(values) - len(finite))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--trials', type=int, default=200)
+    parser.add_argument('--ships', type=int, default=300)
+    parser.add_argument('--docks', type=int, default=4)
+    parser.add_argument('--candidates', type=int, default=8, help='ships of the main group, the escort group has half')
+    parser.add_argument('--broken-level', type=int, default=1, help='broken level of the ship_groups, 1 : 中破')
+    parser.add_argument('--instant-threshold', type=int, default=3600,
+                        help='instant_repair_threshold in seconds for the instant repair run')
+    args = parser.parse_args()
+
+    with common.SyntheticInitData():
+        emulator = zemulator.ZjsnEmulator()
+        emulator.repairDock = [{'id': i, 'locked': 0} for i in range(args.docks)]
+        emulator.fleet = [{'id': i, 'status': 0, 'ships': []} for i in range(1, 9)]
+        emulator.pveExplore = []
+        print('{} trials, {} ships, {} docks, time until ship_groups can fill the fleet'.format(
+            args.trials, args.ships, args.docks))
+        for distribution in DISTRIBUTIONS:
+            results = {'shortest first (old)': [], 'repair_queue': [], 'repair_queue + instant': []}
+            instant_used = []
+            for trial in range(args.trials):
+                rnd = random.Random(trial)
+                dock = common.dock(args.ships, seed=trial)
+                damage(dock, distribution, rnd)
+                emulator.userShip.clear()
+                emulator.userShip.update(dock)
+                ids = [vo['id'] for vo in dock]
+                main_group = rnd.sample(ids, args.candidates)
+                escort_group = rnd.sample(ids, args.candidates // 2)
+                emulator.ship_groups = ([(main_group, args.broken_level, False)] * 4 +
+                                        [(escort_group, args.broken_level, False)] * 2)
+                groups = [(main_group, 4, args.broken_level), (escort_group, 2, args.broken_level)]
+
+                queue = emulator.repair_queue(0)
+                repair_times = emulator.userShip.repair_times()
+                old_queue = sorted(queue, key=lambda ship_id: repair_times[ship_id], reverse=True)
+                results['shortest first (old)'].append(
+                    fleet_ready_time(emulator, emulator.repair_plan(old_queue), groups))
+                results['repair_queue'].append(fleet_ready_time(emulator, emulator.repair_plan(queue), groups))
+
+                emulator.instant_repair_threshold = args.instant_threshold
+                instant = emulator.instant_repair_choice(queue)
+                emulator.instant_repair_threshold = None
+                rest = [ship_id for ship_id in queue if ship_id not in instant]
+                results['repair_queue + instant'].append(
+                    fleet_ready_time(emulator, emulator.repair_plan(rest), groups, set(instant)))
+                instant_used.append(len(instant))
+            print('{} damage'.format(distribution))
+            for name, values in results.items():
+                print('    {:<24} {}'.format(name, summary(values)))
+            print('    instant repairs per trial {:.2f}'.format(statistics.mean(instant_used)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""requests/sec and latency of ZjsnTransport against a local stand-in of a game server
+
+a fresh connection per request is what every request after a re-login used to pay,
+a plain requests.Session is the old transport between re-logins
+
+    python bench/bench_transport.py --workers 4 --requests 2000 --latency 2"""
+import argparse
+import concurrent.futures
+import http.server
+import json
+import socket
+import statistics
+import threading
+import time
+import zlib
+
+import common
+import requests
+import ztransport
+
+
+class GameHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive
+    body = b'{}'
+    latency = 0.0
+
+    def setup(self):
+        super(GameHandler, self).setup()
+        # 头和body分两次写, 不关Nagle的话keep-alive连接每个请求都要等40ms的延迟ACK
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def do_GET(self):
+        if self.latency:
+            time.sleep(self.latency)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(len(self.body)))
+        self.end_headers()
+        self.wfile.write(self.body)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_server(body_kb, latency):
+    payload = json.dumps({'shipVO': [{'id': i, 'text': 'x' * 100} for i in range(body_kb * 8)]}).encode()
+    GameHandler.body = zlib.compress(payload)
+    GameHandler.latency = latency
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), GameHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, len(payload)
+
+
+def run(request, url, workers, total):
+    """requests/sec and per-request latencies of total requests from workers threads"""
+    def one(_):
+        start = time.perf_counter()
+        r = request(url)
+        content = r.content
+        # compressed=True的ZjsnTransport读的时候已经解压了
+        ztransport.loads(content if content[:1] == b'{' else zlib.decompress(content))
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+        latencies = list(pool.map(one, range(total)))
+    return total / (time.perf_counter() - start), sorted(latencies)
+
+
+def percentile(values, p):
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, default=4, help='concurrent requests, like the login fan-out')
+    parser.add_argument('--requests', type=int, default=1000)
+    parser.add_argument('--latency', type=float, default=0.0, help='server think time in ms')
+    parser.add_argument('--body-kb', type=int, default=16, help='uncompressed body size')
+    args = parser.parse_args()
+
+    server, body_size = start_server(args.body_kb, args.latency / 1000)
+    url = 'http://127.0.0.1:{}/pve/getUserData/'.format(server.server_address[1])
+    session = requests.Session()
+    transport = ztransport.ZjsnTransport(pool_maxsize=args.workers)
+    streaming = ztransport.ZjsnTransport(pool_maxsize=args.workers, compressed=True)
+    clients = [('new connection per request', lambda u: requests.get(u, timeout=30)),
+               ('requests.Session', lambda u: session.get(u, timeout=30)),
+               ('ZjsnTransport', lambda u: transport.request('GET', u)),
+               ('ZjsnTransport compressed', lambda u: streaming.request('GET', u))]
+    print('{} workers, {} requests, body {:.0f} KB, server latency {} ms'.format(
+        args.workers, args.requests, body_size / 1024, args.latency))
+    for name, request in clients:
+        run(request, url, args.workers, min(50, args.requests))  # 预热连接池
+        rate, latencies = run(request, url, args.workers, args.requests)
+        print('{:<28} {:>8.0f} req/s   p50 {}   p99 {}'.format(
+            name, rate, common.ms(statistics.median(latencies)), common.ms(percentile(latencies, 99))))
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
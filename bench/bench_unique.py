@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+"""cost of ZjsnUserShip.unique: the old sort and list scan on every access against the cached view
+
+    python bench/bench_unique.py --ships 500"""
+import argparse
+
+import common
+import zemulator
+
+
+def unique_uncached(user_ship):
+    """ZjsnUserShip.unique before it was cached, an O(n^2) evoCid scan on every access"""
+    ships = []
+    ships_evoCid = []
+    for ship in sorted(user_ship, key=lambda x: (x.can_evo or x.evolved, x.level, x.locked), reverse=True):
+        if ship.evoCid not in ships_evoCid:
+            ships_evoCid.append(ship.evoCid)
+            ships.append(ship)
+    return ships
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--ships", type=int, default=500)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--number", type=int, default=20, help="accesses per timed run")
+    args = parser.parse_args()
+
+    with common.SyntheticInitData():
+        user_ship = zemulator.ZjsnUserShip()
+        user_ship.update(common.dock(args.ships))
+        assert [s.id for s in user_ship.unique] == [s.id for s in unique_uncached(user_ship)]
+        ship_id = next(iter(user_ship)).id
+
+        def changed():
+            # 换一条等级不同的船进来, 缓存失效
+            vo = dict(user_ship[ship_id])
+            vo["level"] = vo["level"] % 110 + 1
+            user_ship[ship_id] = vo
+            return user_ship.unique
+
+        before, _ = common.timed(lambda: unique_uncached(user_ship), args.repeat, args.number)
+        cached, _ = common.timed(lambda: user_ship.unique, args.repeat, args.number)
+        rebuilt, _ = common.timed(changed, args.repeat, args.number)
+        print("{} ships, {} unique".format(len(user_ship), len(user_ship.unique)))
+        print("uncached scan per access     {}".format(common.us(before)))
+        print("cached access                {}".format(common.us(cached)))
+        print("access after a ship change   {}".format(common.us(rebuilt)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""shared helpers of the benchmark scripts: repo import path, timing and synthetic game data
+
+the synthetic data only has the fields the measured code reads, sizes follow a real account"""
+import json
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+SHIP_TYPES = list(range(1, 17)) + [23, 24]
+PROPS = ["hp", "atk", "def", "torpedo", "antisub", "radar", "hit", "miss", "speed", "range", "luck",
+         "air_def", "oil", "ammo", "aluminium", "antiAircraft"]
+
+
+def timed(func, repeat=5, number=1):
+    """seconds per call of func, (best, median) over repeat runs of number calls"""
+    runs = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        runs.append((time.perf_counter() - start) / number)
+    return min(runs), statistics.median(runs)
+
+
+def ms(seconds):
+    return "{:.2f} ms".format(seconds * 1000)
+
+
+def us(seconds):
+    return "{:.1f} us".format(seconds * 1e6)
+
+
+def init_data(cards=3000, equipments=800, seed=1):
+    """getInitConfigs payload with the tables InitData keeps, plus the bulk it drops"""
+    rnd = random.Random(seed)
+    ship_cards = []
+    for i in range(cards):
+        ship_cards.append({"cid": str(10000011 + i * 100),
+                           "title": "舰娘{}号".format(i),
+                           "type": rnd.choice(SHIP_TYPES),
+                           "star": rnd.randint(1, 6),
+                           "evoCid": str(10000011 + (i // 2) * 200),
+                           "canEvo": str(i % 2),
+                           "evoClass": str(i % 2),
+                           "evoLevel": "20",
+                           "repairTime": round(rnd.uniform(0.1, 2.0), 2),
+                           "strengthenTop": {"atk": 50, "def": 40, "torpedo": 30, "air_def": 20}})
+    return {"DataVersion": "20181001",
+            "shipCard": ship_cards,
+            "shipEquipmnt": [{"cid": str(10000021 + i * 100), "title": "装备{}".format(i), "star": 2}
+                             for i in range(equipments)],
+            "errorCode": {"-1": "操作太快", "-215": "船坞已满"},
+            # 地图, 任务, 商店这些InitData不用的部分
+            "unused": [{"id": i, "text": "x" * 200} for i in range(20000)]}
+
+
+def write_init_file(path, **kwargs):
+    with open(path, "w", encoding="utf8") as f:
+        json.dump(init_data(**kwargs), f, ensure_ascii=False)
+
+
+class SyntheticInitData(object):
+    """point zemulator._INIT_DATA_ at a synthetic init.txt in a temp directory while the block runs"""
+
+    def __init__(self, cards=3000):
+        self.cards = cards
+        self.directory = None
+
+    def __enter__(self):
+        import zemulator
+        self.directory = tempfile.mkdtemp(prefix="zjsn_bench_")
+        data = zemulator._INIT_DATA_
+        data.init_file_path = os.path.join(self.directory, "init.txt")
+        data.init_file_path_japan = os.path.join(self.directory, "init_japan.txt")
+        data.cache_file_path = os.path.join(self.directory, "init.cache")
+        data.trans_table_path = os.path.join(self.directory, "trans_table.json")
+        write_init_file(data.init_file_path, cards=self.cards)
+        data.load()
+        return data
+
+    def __exit__(self, *exc):
+        shutil.rmtree(self.directory)
+
+
+def ship_vo(ship_id, cids, rnd):
+    """one shipVO with the nested prop dicts of a real one"""
+    cid = rnd.choice(cids)
+    props_max = {k: rnd.randint(10, 300) for k in PROPS}
+    props = dict(props_max, hp=rnd.randint(1, props_max["hp"]) if rnd.random() < 0.4 else props_max["hp"])
+    return {"id": ship_id, "uid": 123456, "shipCid": cid, "level": rnd.randint(1, 110),
+            "exp": rnd.randint(0, 10 ** 6), "nextExp": rnd.randint(0, 10 ** 6), "title": "t{}".format(cid),
+            "isLocked": rnd.randint(0, 1), "married": int(rnd.random() < 0.1), "marry_time": 0,
+            "love": rnd.randint(0, 200), "loveMax": 200, "fleetId": 0, "status": 0,
+            "create_time": 1500000000 + ship_id, "battleProps": props, "battlePropsMax": props_max,
+            "battlePropsBasic": {k: v // 2 for k, v in props_max.items()},
+            "strengthenAttribute": {"atk": rnd.randint(0, 50), "def": rnd.randint(0, 40),
+                                    "torpedo": rnd.randint(0, 30), "air_def": rnd.randint(0, 20)},
+            "equipment": [0, 0, 0, 0], "equipmentArr": [], "capacitySlot": [0, 0, 0, 0],
+            "capacitySlotMax": [0, 0, 0, 0], "missileSlot": [0, 0, 0, 0], "missileSlotMax": [0, 0, 0, 0],
+            "skillId": 0, "skillLevel": 1, "skillType": 1, "isSecretary": 0, "tactics": [0, 0, 0]}
+
+
+def dock(ships=500, seed=1):
+    """shipVO list of a dock, cards come from the loaded _INIT_DATA_"""
+    import zemulator
+    rnd = random.Random(seed)
+    cids = list(zemulator._INIT_DATA_.ship_card)
+    return [ship_vo(ship_id, cids, rnd) for ship_id in range(1, ships + 1)]
@@ -31,7 +31,7 @@ class Mission_5_2_C(zrobot.Mission):
             zrobot._logger.info('有北京风了，2-5已经毕业')
             return
         ss_ships = []
-        for ship in sorted(self.ze.userShip, key=lambda x: x["level"], reverse=True):
+        for ship in self.ze.userShip.of_type(['潜艇', '炮潜'], reverse=True):
             conditions = [ship["level"] > 1,
                           ship.type in ['潜艇', '炮潜'],
                           ]
@@ -74,7 +74,7 @@ class Mission_2_5_mid(zrobot.Mission):
             zrobot._logger.info('有岛风了，2-5中路已经毕业')
             return
         ss_ships = []
-        for ship in sorted(self.ze.userShip, key=lambda x: x["level"], reverse=True):
+        for ship in self.ze.userShip.of_type(['潜艇'], reverse=True):
             conditions = [ship["level"] > 60,
                           ship.type in ['潜艇'],
                           ]
@@ -87,7 +87,7 @@ class Mission_2_5_mid(zrobot.Mission):
 
         cv_ships = []
         # 所有高速，高级航母
-        for ship in sorted(self.ze.userShip, key=lambda x: x["level"], reverse=True):
+        for ship in self.ze.userShip.of_type(['航母', '装母'], reverse=True):
             conditions = [ship["level"] > 75,
                           ship.type in ['航母', '装母'],
                           ship.speed > 30,
@@ -127,7 +127,7 @@ class Mission_5_5_C(zrobot.Mission):
     def prepare(self):
         # 所有90级以上水下船只
         ss_ships = []
-        for ship in sorted(self.ze.userShip, key=lambda x: x["level"], reverse=True):
+        for ship in self.ze.userShip.of_type(['潜艇', '炮潜'], reverse=True):
             conditions = [ship["level"] >= 70,
                           ship.type in ['潜艇', '炮潜'],
                           ]
@@ -159,7 +159,7 @@ class Mission_5_5_B(zrobot.Mission):
         cv_ship = [43707]
         # 所有改造后的ca, 等级从低到高
         ca_ships = []
-        for ship in sorted(self.ze.userShip, key=lambda x: x["level"], reverse=False):
+        for ship in self.ze.userShip.of_type(['重巡'], reverse=False):
             conditions = [ship["level"] < 100,
                           ship.type in ['重巡'],
                           ship.evolved,
@@ -201,7 +201,7 @@ class Mission_2_5_up(zrobot.Mission):
             return False
         # 所有高级潜艇
         ss_ships = []
-        for ship in sorted(self.ze.userShip, key=lambda x: x["level"], reverse=True):
+        for ship in self.ze.userShip.of_type(['潜艇'], reverse=True):
             conditions = [ship["level"] > 60,
                           ship.type in ['潜艇'],
                           ]
@@ -245,7 +245,7 @@ class Mission_2_5_down(zrobot.Mission):
     def prepare(self):
         # 所有能开幕的水下船只
         ss_ships = []
-        for ship in sorted(self.ze.userShip, key=lambda x: x["level"], reverse=True):
+        for ship in self.ze.userShip.of_type(['潜艇', '炮潜'], reverse=True):
             conditions = [ship["level"] > 11,
                           ship.type in ['潜艇', '炮潜'],
                           ]
@@ -285,7 +285,7 @@ class Mission_6_3(zrobot.Mission):
             return False
         # 所有能开幕的水下船只
         ss_ships = []
-        for ship in sorted(self.ze.userShip, key=lambda x: x["level"], reverse=True):
+        for ship in self.ze.userShip.of_type(['潜艇', '炮潜'], reverse=True):
             conditions = [ship["level"] > 75,
                           ship.type in ['潜艇', '炮潜'],
                           ]
@@ -329,6 +329,9 @@ class MissionPants(zrobot.Mission):
             self.pants_yesterday = self.ze.spoils
         return self.ze.spoils_event and self.ze.todaySpoilsNum < 50
 
+    def ready(self):
+        return self.pants_available and super().ready()
+
     def prepare(self):
         if not self.pants_available:
             self.available = False
@@ -339,7 +342,7 @@ class MissionPants(zrobot.Mission):
                 self.ze.todaySpoilsNum, self.count))
         # 所有高级改造DD
         dd_ships = []
-        for ship in sorted(self.ze.userShip, key=lambda x: x["level"], reverse=False):
+        for ship in self.ze.userShip.of_type(['驱逐'], reverse=False):
             conditions = [ship["level"] > 80,
                           ship.type in ['驱逐'],
                           ship.evolved == 1,
@@ -352,7 +355,7 @@ class MissionPants(zrobot.Mission):
 
         # 所有高级改造cv
         cv_ships = []
-        for ship in sorted(self.ze.userShip, key=lambda x: x["level"], reverse=False):
+        for ship in self.ze.userShip.of_type(['航母'], reverse=False):
             conditions = [ship.type in ['航母'],
                           ship.level > 1,
                           ship.evolved == 1 or not ship.can_evo,
@@ -401,7 +404,7 @@ class Mission_4_3(zrobot.Mission):
     def prepare(self):
         # 所有高级改造DD
         dd_ships = []
-        for ship in sorted(self.ze.userShip, key=lambda x: x["level"], reverse=False):
+        for ship in self.ze.userShip.of_type(['驱逐'], reverse=False):
             conditions = [ship["level"] > 80,
                           ship.type in ['驱逐'],
                           ship.evolved == 1,
@@ -445,7 +448,7 @@ class Mission_5_3(zrobot.Mission):
     def prepare(self):
         # 所有高级DD
         dd_ships = []
-        for ship in sorted(self.ze.userShip, key=lambda x: x["level"], reverse=False):
+        for ship in self.ze.userShip.of_type(['驱逐'], reverse=False):
             conditions = [ship["level"] > 80,
                           ship.type in ['驱逐'],
                           # ship.evolved == 1,
@@ -488,7 +491,7 @@ class Mission_2_2(zrobot.Mission):
     def prepare(self):
         # 单DD偷油，擦伤就修，防止大破劝退
         dd_ships = []
-        for ship in sorted(self.ze.userShip, key=lambda x: x["level"], reverse=False):
+        for ship in self.ze.userShip.of_type(['驱逐'], reverse=False):
             conditions = [ship["level"] > 80,
                           ship.type in ['驱逐'],
                           ship.evolved == 1,
@@ -557,7 +560,7 @@ class Mission_6_4(zrobot.Mission):
         boss_ships = [s.id for s in self.ze.userShip if s.name ==
                       '赤城' and s.level > 80]  # 赤城带队洗地
         cv_ships = []
-        for ship in sorted(self.ze.userShip, key=lambda x: x["level"], reverse=True):
+        for ship in self.ze.userShip.of_type(['航母'], reverse=True):
             conditions = [20 < ship["level"] < 100,
                           ship.type in ['航母'],
                           ship.name not in ['突击者', '赤城'],
@@ -570,7 +573,7 @@ class Mission_6_4(zrobot.Mission):
 
         # 所有改造后的ca, 等级从低到高
         ca_ships = []
-        for ship in sorted(self.ze.userShip, key=lambda x: x["level"], reverse=False):
+        for ship in self.ze.userShip.of_type(['重巡'], reverse=False):
             conditions = [ship["level"] < 100,
                           ship.type in ['重巡'],
                           ship.evolved,
@@ -622,7 +625,7 @@ class Mission_6_4_fish(zrobot.Mission):
             return False
         # 所有能开幕的水下船只
         ss_ships = []
-        for ship in sorted(self.ze.userShip, key=lambda x: x["level"], reverse=True):
+        for ship in self.ze.userShip.of_type(['潜艇', '炮潜'], reverse=True):
             conditions = [ship["level"] > 75,
                           ship.type in ['潜艇', '炮潜'],
                           ]
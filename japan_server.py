@@ -51,7 +51,7 @@ class Mission1_4(zrobot.Mission):
     def prepare(self):
         # 所有高级改造DD
         dd_ships = []
-        for ship in sorted(self.ze.userShip, key=lambda x: x["level"], reverse=True):
+        for ship in self.ze.userShip.of_type(['驱逐'], reverse=True):
             conditions = [ship.locked,
                           ship.type in ['驱逐'],
                           ]
@@ -144,7 +144,7 @@ class Mission3_4_A(zrobot.Mission):
         fleet_group = [([i], 1, False) for i in fleet]
         self.ze.ship_groups = fleet_group
         dd_ships = []
-        for ship in sorted(self.ze.userShip, key=lambda x: x["level"], reverse=False):
+        for ship in self.ze.userShip.of_type(['驱逐'], reverse=False):
             conditions = [ship["level"] > 1,
                           ship.type in ['驱逐'],
                           ship.can_evo or ship.evolved,
@@ -0,0 +1,54 @@
+"""importing zemulator must stay cheap: the card tables, numpy and aiohttp are loaded at first use"""
+import json
+import os
+import subprocess
+import sys
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 秒, 现在的导入时间大头是distutils
+IMPORT_BUDGET = 1.0
+
+# 记下尝试导入的模块, 没装numpy的时候try import numpy也能被发现
+PROBE = """
+import json, sys, time
+attempted = set()
+class Recorder(object):
+    def find_spec(self, name, path=None, target=None):
+        attempted.add(name.partition('.')[0])
+sys.meta_path.insert(0, Recorder())
+start = time.perf_counter()
+import zemulator
+elapsed = time.perf_counter() - start
+print(json.dumps({'elapsed': elapsed,
+                  'numpy': 'numpy' in attempted,
+                  'aiohttp': 'aiohttp' in attempted,
+                  'init_data_loaded': zemulator._INIT_DATA_._loaded}))
+"""
+
+
+def import_zemulator():
+    """import zemulator in a fresh interpreter, returns what the probe saw"""
+    out = subprocess.check_output([sys.executable, '-c', PROBE], cwd=ROOT)
+    return json.loads(out.decode().strip().splitlines()[-1])
+
+
+class ImportTimeTest(unittest.TestCase):
+    def setUp(self):
+        # 冷启动的第一次可能被磁盘缓存拖慢, 取两次里快的
+        self.probe = min((import_zemulator() for _ in range(2)), key=lambda p: p['elapsed'])
+
+    def test_init_data_deferred(self):
+        self.assertFalse(self.probe['init_data_loaded'])
+
+    def test_optional_imports_deferred(self):
+        self.assertFalse(self.probe['numpy'])
+        self.assertFalse(self.probe['aiohttp'])
+
+    def test_budget(self):
+        self.assertLess(self.probe['elapsed'], IMPORT_BUDGET)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,19 +1,28 @@
 #!/usr/bin/env python3
+import array
 import base64
+import bisect
 import collections
+import collections.abc
+import concurrent.futures
 import datetime
 import distutils.version
-import itertools
+import heapq
 import json
 import logging
 import math
 import os
+import pickle
+import threading
 import time
 from typing import Iterator, Dict
 
 import requests
 import requests.exceptions
 
+import zmetrics
+import ztransport
+
 zlogger = logging.getLogger('zjsn.zrobot.zemulator')
 
 
@@ -32,59 +41,235 @@ zlogger = logging.getLogger('zjsn.zrobot.zemulator')
 
 class InitData(object):
     """init data for zjsn"""
+    # 缓存格式变化时加一, 旧缓存会被自动丢弃
+    CACHE_FORMAT = 1
+    # 日系舰名对照表的本地缓存有效期
+    TRANS_TABLE_MAX_AGE = 7 * 24 * 60 * 60
 
     def __init__(self):
         self._data = None
         self._data_j = None
-        self.ship_card = None  # type: Dict{int, Dict}
-        self.error_code = None
-        self.equipment_card = None
-        self.version = distutils.version.LooseVersion("0")
-        self.version_japan = distutils.version.LooseVersion("0")
+        self._loaded = False
+        self._ship_card = None  # type: Dict{int, Dict}
+        self._error_code = None
+        self._equipment_card = None
+        self._version = distutils.version.LooseVersion("0")
+        self._version_japan = distutils.version.LooseVersion("0")
+        self._name_index = None
+        self.card_revision = 0  # 卡片数据每次变化都加一, 用来丢弃由卡片推导出的缓存
         self.init_file_path = os.path.dirname(os.path.realpath(__file__)) + os.sep + "init.txt"
         self.init_file_path_japan = os.path.dirname(os.path.realpath(__file__)) + os.sep + "init_japan.txt"
+        self.cache_file_path = os.path.dirname(os.path.realpath(__file__)) + os.sep + "init.cache"
+        self.trans_table_path = os.path.dirname(os.path.realpath(__file__)) + os.sep + "trans_table.json"
+        self._sources = {"china": None, "japan": None}
+        self._trans_lock = threading.Lock()
+        self._load_lock = threading.RLock()
+
+    # 数据在第一次被访问时才加载, 只import模块不会读取init.txt
+    def _ensure_loaded(self):
+        if not self._loaded:
+            with self._load_lock:
+                # 等锁的线程进来时别的线程可能已经加载完了
+                if not self._loaded:
+                    self.load()
+
+    @property
+    def ship_card(self):
+        self._ensure_loaded()
+        return self._ship_card
+
+    @ship_card.setter
+    def ship_card(self, value):
+        self._loaded = True
+        self._ship_card = value
+        self._name_index = None
+        self.card_revision += 1
+
+    @property
+    def equipment_card(self):
+        self._ensure_loaded()
+        return self._equipment_card
+
+    @equipment_card.setter
+    def equipment_card(self, value):
+        self._loaded = True
+        self._equipment_card = value
+
+    @property
+    def error_code(self):
+        self._ensure_loaded()
+        return self._error_code
 
-        self.load()
+    @error_code.setter
+    def error_code(self, value):
+        self._loaded = True
+        self._error_code = value
+
+    @property
+    def version(self):
+        self._ensure_loaded()
+        return self._version
+
+    @property
+    def version_japan(self):
+        self._ensure_loaded()
+        return self._version_japan
 
     def load(self):
-        """load init.txt and parse the json format data"""
-        if os.path.exists(self.init_file_path):
-            # get china server data
-            try:
-                with open(self.init_file_path, encoding="utf8") as f:
-                    self._data = json.load(f)
-                self.ship_card = {int(i['cid']): i for i in self._data["shipCard"]}
-                self.error_code = self._data['errorCode']
-                self.equipment_card = {int(i['cid']): i for i in self._data["shipEquipmnt"]}
-                self.version = distutils.version.LooseVersion(self._data["DataVersion"])
-                # get japan server data
-                if os.path.exists(self.init_file_path_japan):
-                    with open(self.init_file_path_japan, encoding="utf8") as f:
-                        self._data_j = json.load(f)
-            except ValueError:
-                self.version = distutils.version.LooseVersion("000")
-                return
-            self.version = distutils.version.LooseVersion(self._data["DataVersion"])
-            if self._data_j:
-                self.ship_card.update(
-                    {int(i['cid']): i for i in self._data_j["shipCard"] if int(i['cid']) not in self.ship_card})
-                self.equipment_card.update({int(i['cid']): i for i in self._data_j["shipEquipmnt"] if
-                                            int(i['cid']) not in self.equipment_card})
+        """load parsed init data from init.cache, re-parse init.txt only when the cache is stale
+
+        other threads see the data as loaded only after every table is filled"""
+        with self._load_lock:
+            stamps = self._source_stamps()
+            cache = self._read_cache(stamps)
+            if cache is None:
+                try:
+                    cache = {"china": self._parse_init_file(self.init_file_path),
+                             "japan": self._parse_init_file(self.init_file_path_japan)}
+                except ValueError:
+                    cache = None
+                    self._version = distutils.version.LooseVersion("000")
+                if cache and cache["china"]:
+                    self._write_cache(stamps, cache)
+            if cache is not None:
+                self._sources = {"china": cache["china"], "japan": cache["japan"]}
+                self._apply(cache["china"], cache["japan"])
+            self._name_index = None
+            self.card_revision += 1
+            self._loaded = True
+
+    @staticmethod
+    def _tables_from_data(data):
+        """the tables we use from a getInitConfigs payload"""
+        return {"version": data["DataVersion"],
+                "ship_card": {int(i['cid']): i for i in data["shipCard"]},
+                "equipment_card": {int(i['cid']): i for i in data["shipEquipmnt"]},
+                "error_code": data['errorCode']}
+
+    def _parse_init_file(self, file_path):
+        """parse one init file into the tables we use, the rest of getInitConfigs is dropped"""
+        if not os.path.exists(file_path):
+            return None
+        with open(file_path, encoding="utf8") as f:
+            data = json.load(f)
+        return self._tables_from_data(data)
+
+    def _apply(self, china, japan):
+        if not china:
+            self._version = distutils.version.LooseVersion("000")
+            return
+        self._translate_cards(china["ship_card"].values(), self._read_trans_table()[0])
+        self._ship_card = dict(china["ship_card"])
+        self._error_code = china["error_code"]
+        self._equipment_card = dict(china["equipment_card"])
+        self._version = distutils.version.LooseVersion(china["version"])
+        if japan:
+            for cid, card in japan["ship_card"].items():
+                self._ship_card.setdefault(cid, card)
+            for cid, card in japan["equipment_card"].items():
+                self._equipment_card.setdefault(cid, card)
+            self._version_japan = distutils.version.LooseVersion(japan["version"])
+
+    def _apply_delta(self, source, tables):
+        """replace only the cards of source which differ from tables, china cards win over japan cards"""
+        old = self._sources.get(source) or {"ship_card": {}, "equipment_card": {}}
+        self._sources[source] = tables
+        if self._ship_card is None:
+            self._apply(self._sources["china"], self._sources["japan"])
+            return len(tables["ship_card"]) + len(tables["equipment_card"])
+        other = self._sources["japan" if source == "china" else "china"]
+        changed = 0
+        for table_name, merged in (("ship_card", self._ship_card), ("equipment_card", self._equipment_card)):
+            old_cards = old[table_name]
+            new_cards = tables[table_name]
+            other_cards = other[table_name] if other else {}
+            for cid, card in new_cards.items():
+                if old_cards.get(cid) != card:
+                    changed += 1
+                    if source == "china" or cid not in other_cards:
+                        merged[cid] = card
+            for cid in old_cards.keys() - new_cards.keys():
+                changed += 1
+                if source == "china" and cid in other_cards:
+                    merged[cid] = other_cards[cid]
+                elif source == "china" or cid not in other_cards:
+                    merged.pop(cid, None)
+        if source == "china":
+            self._error_code = tables["error_code"]
+            self._version = distutils.version.LooseVersion(tables["version"])
         else:
-            self.version = distutils.version.LooseVersion("000")
+            self._version_japan = distutils.version.LooseVersion(tables["version"])
+        if changed:
+            self._name_index = None
+            self.card_revision += 1
+        return changed
+
+    def _source_stamps(self):
+        """mtime and size of init files, a changed file invalidates the cache"""
+        stamps = []
+        for file_path in (self.init_file_path, self.init_file_path_japan):
+            if os.path.exists(file_path):
+                st = os.stat(file_path)
+                stamps.append((st.st_mtime_ns, st.st_size))
+            else:
+                stamps.append(None)
+        return stamps
+
+    @staticmethod
+    def _atomic_write(file_path, content):
+        """write to a temp file and rename it, readers never see a half written file"""
+        tmp_path = file_path + ".tmp"
+        if isinstance(content, bytes):
+            with open(tmp_path, "wb") as f:
+                f.write(content)
+        else:
+            with open(tmp_path, "w", encoding="utf8") as f:
+                f.write(content)
+        os.replace(tmp_path, file_path)
+
+    def _read_cache(self, stamps):
+        if not os.path.exists(self.cache_file_path):
+            return None
+        try:
+            with open(self.cache_file_path, "rb") as f:
+                cache = pickle.load(f)
+        except Exception as e:
+            zlogger.warning("drop broken init cache: {}".format(e))
+            return None
+        if cache.get("format") != self.CACHE_FORMAT or cache.get("stamps") != stamps:
+            return None
+        china = cache["china"]
+        if not china or china["version"] != cache.get("DataVersion"):
+            return None
+        return cache
+
+    def _write_cache(self, stamps, cache):
+        cache = {"format": self.CACHE_FORMAT,
+                 "stamps": stamps,
+                 "DataVersion": cache["china"]["version"],
+                 "china": cache["china"],
+                 "japan": cache["japan"]}
+        try:
+            self._atomic_write(self.cache_file_path, pickle.dumps(cache, protocol=pickle.HIGHEST_PROTOCOL))
+        except OSError as e:
+            zlogger.warning("can not write init cache: {}".format(e))
 
     def update(self, data, japan=False):
+        """save a new getInitConfigs payload, only the cards that changed are replaced in memory"""
+        self._ensure_loaded()
         self._data = data
         if not japan:
             self.rename()
-            with open(self.init_file_path, "w", encoding="utf8") as f:
-                json.dump(self._data, f)
+            self._atomic_write(self.init_file_path, json.dumps(self._data))
         else:
-            with open(self.init_file_path_japan, "w", encoding="utf8") as f:
-                json.dump(self._data, f)
-        self.load()
-
-    def get_trans_table(self):
+            self._atomic_write(self.init_file_path_japan, json.dumps(self._data))
+        changed = self._apply_delta("japan" if japan else "china", self._tables_from_data(data))
+        zlogger.info("init data updated to {}, {} cards changed".format(data["DataVersion"], changed))
+        if self._sources["china"]:
+            self._write_cache(self._source_stamps(), self._sources)
+
+    def fetch_trans_table(self):
+        """download 日系舰名对照表 from the wiki"""
         from pyquery import PyQuery as pq
         name_table = {}
         r = requests.get(
@@ -100,22 +285,111 @@ class InitData(object):
 
         return name_table
 
-    def rename(self):
-        tb = self.get_trans_table()
-        new_girl = {}
-        for girl in self._data["shipCard"]:
-            new_girl[girl["cid"]] = girl
+    def _read_trans_table(self):
+        """cached name table and the time it was fetched"""
+        if not os.path.exists(self.trans_table_path):
+            return {}, 0
+        try:
+            with open(self.trans_table_path, encoding="utf8") as f:
+                cache = json.load(f)
+            return cache["table"], cache["time"]
+        except (ValueError, KeyError) as e:
+            zlogger.warning("drop broken name table cache: {}".format(e))
+            return {}, 0
+
+    def get_trans_table(self):
+        """name table from the local cache, an expired cache is refreshed in background, never blocks"""
+        table, fetch_time = self._read_trans_table()
+        if time.time() - fetch_time > self.TRANS_TABLE_MAX_AGE:
+            self.refresh_trans_table(block=False)
+        return table
+
+    def refresh_trans_table(self, block=True):
+        if not block:
+            threading.Thread(target=self.refresh_trans_table, daemon=True).start()
+            return
+        if not self._trans_lock.acquire(blocking=False):
+            return  # another refresh is running
+        try:
+            table = self.fetch_trans_table()
+            self._atomic_write(self.trans_table_path,
+                               json.dumps({"time": time.time(), "table": table}, ensure_ascii=False))
+        except Exception as e:
+            zlogger.warning("can not refresh name table: {}".format(e))
+            return
+        finally:
+            self._trans_lock.release()
+        if self._loaded and self._sources.get("china"):
+            if self._translate_cards(self._sources["china"]["ship_card"].values(), table):
+                self._name_index = None
+                self.card_revision += 1
+
+    @staticmethod
+    def _translate_cards(cards, tb):
+        translated = False
+        for girl in cards:
             if girl["title"] in tb:
                 zlogger.info(girl["title"] + " ==> " + tb[girl["title"]])
                 girl["title"] = tb[girl["title"]]
+                translated = True
+        return translated
 
-    def get_card_by_name(self, name):
-        cards = self.ship_card
-        for c in cards:
-            n = cards[c]['title'].replace(' ', '')
-            if name in n:
-                return cards[c]
-        return None
+    def rename(self):
+        self._translate_cards(self._data["shipCard"], self.get_trans_table())
+
+    def _build_name_index(self):
+        """index ship cards by normalized title, single chars and bigrams are mapped to card positions"""
+        cards = list(self.ship_card.values())
+        titles = [card['title'].replace(' ', '') for card in cards]
+        exact = {}
+        grams = collections.defaultdict(list)
+        for pos, title in enumerate(titles):
+            exact.setdefault(title, pos)
+            for g in set(title) | {title[i:i + 2] for i in range(len(title) - 1)}:
+                grams[g].append(pos)
+        self._name_index = (cards, titles, exact, dict(grams))
+        return self._name_index
+
+    def _name_candidates(self, name):
+        """card positions which may contain name, in ship_card order"""
+        cards, titles, exact, grams = self._name_index or self._build_name_index()
+        if not name:
+            return range(len(cards))
+        if len(name) == 1:
+            return grams.get(name, [])
+        postings = sorted((grams.get(name[i:i + 2], []) for i in range(len(name) - 1)), key=len)
+        if not postings[0]:
+            return []
+        candidates = set(postings[0])
+        for p in postings[1:]:
+            candidates.intersection_update(p)
+            if not candidates:
+                return []
+        return sorted(candidates)
+
+    def _iter_cards_by_name(self, name, match):
+        cards, titles, exact, grams = self._name_index or self._build_name_index()
+        if match == "exact":
+            if name in exact:
+                yield cards[exact[name]]
+        elif match == "prefix":
+            for pos in self._name_candidates(name):
+                if titles[pos].startswith(name):
+                    yield cards[pos]
+        elif match == "substring":
+            for pos in self._name_candidates(name):
+                if name in titles[pos]:
+                    yield cards[pos]
+        else:
+            raise ValueError("unknown match type {}".format(match))
+
+    def get_cards_by_name(self, name, match="substring"):
+        """match is one of "exact", "prefix", "substring", titles are compared without spaces"""
+        return list(self._iter_cards_by_name(name, match))
+
+    def get_card_by_name(self, name, match="substring"):
+        """first card in ship_card order whose title matches name"""
+        return next(self._iter_cards_by_name(name, match), None)
 
 _INIT_DATA_ = InitData()
 
@@ -264,12 +538,230 @@ class ZjsnApi(object):
     def getTactics(self):
         return self.host + '/live/getTactics'
 
+_numpy = None  # 第一次用到列视图时才import, 没装numpy是False
+
+
+def load_numpy():
+    """numpy when it is installed, None otherwise. imported at first use, importing zemulator stays cheap"""
+    global _numpy
+    if _numpy is None:
+        try:
+            import numpy
+            _numpy = numpy
+        except ImportError:
+            _numpy = False
+    return _numpy or None
+
+
+class ShipColumns(object):
+    """hp, max hp, level, married and card repairTime of every ship in one column each,
+    numpy arrays when numpy is installed, lists otherwise"""
+
+    # broken level -> (a, b), 破损是 hp * a < max hp * b
+    broken_factors = {0: (1, 1), 1: (2, 1), 2: (4, 1)}
+
+    def __init__(self, ships):
+        super(ShipColumns, self).__init__()
+        ships = list(ships)
+        self.ships = ships
+        self.ids = [ship.id for ship in ships]
+        self.hp = [ship["battleProps"]["hp"] for ship in ships]
+        self.hp_max = [ship["battlePropsMax"]["hp"] for ship in ships]
+        self.level = [ship.level for ship in ships]
+        self.married = [ship.married for ship in ships]
+        self.card_repair_time = [ship.card['repairTime'] if ship.card else 0 for ship in ships]
+        numpy = load_numpy()
+        if numpy is not None:
+            self.hp = numpy.array(self.hp, dtype=numpy.float64)
+            self.hp_max = numpy.array(self.hp_max, dtype=numpy.float64)
+            self.level = numpy.array(self.level, dtype=numpy.float64)
+            self.married = numpy.array(self.married, dtype=bool)
+            self.card_repair_time = numpy.array(self.card_repair_time, dtype=numpy.float64)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def broken_ids(self, broken_level=0):
+        """ids of ZjsnShip.is_broken ships"""
+        if 0 < broken_level < 1:
+            a, b = 1, broken_level
+        elif broken_level in self.broken_factors:
+            a, b = self.broken_factors[broken_level]
+        else:
+            return []
+        numpy = load_numpy()
+        if numpy is not None:
+            return [self.ids[i] for i in numpy.flatnonzero(self.hp * a < self.hp_max * b)]
+        return [ship_id for ship_id, hp, hp_max in zip(self.ids, self.hp, self.hp_max) if hp * a < hp_max * b]
+
+    def repair_times(self):
+        """{ship id: ZjsnShip.repair_time} of every ship"""
+        numpy = load_numpy()
+        if numpy is not None:
+            l = self.level
+            a = numpy.where(l < 11, 0, numpy.floor(10 * numpy.sqrt(numpy.maximum(l - 11, 0)) + 50))
+            d = self.hp_max - self.hp
+            t = numpy.ceil(((l * 5 + a) * self.card_repair_time * d + 30) * numpy.where(self.married, 0.7, 1))
+            t = numpy.where(d == 0, 0, t)
+            return dict(zip(self.ids, t.astype(numpy.int64).tolist()))
+        times = {}
+        for ship_id, hp, hp_max, l, married, r in zip(self.ids, self.hp, self.hp_max, self.level, self.married,
+                                                      self.card_repair_time):
+            d = hp_max - hp
+            if d == 0:
+                times[ship_id] = 0
+                continue
+            a = 0 if l < 11 else math.floor(10 * math.sqrt(l - 11) + 50)
+            times[ship_id] = math.ceil(((l * 5 + a) * r * d + 30) * (0.7 if married else 1))
+        return times
+
+    def strength_exps(self):
+        """{ship id: ZjsnShip.strength_exp} of the ships whose card has strengthenTop
+
+        the strengthen columns are only gathered here, most column users never need them"""
+        ids, current, top = [], [], []
+        for ship_id, ship in zip(self.ids, self.ships):
+            strengthen_top = ship._card_info.strengthen_top
+            if strengthen_top is not None:
+                attribute = ship['strengthenAttribute']
+                ids.append(ship_id)
+                if type(attribute) is ShipProps:
+                    current.append(attribute.sorted_values())
+                else:
+                    current.append([v for _, v in sorted(attribute.items())])
+                top.append(strengthen_top)
+        numpy = load_numpy()
+        if numpy is not None and ids:
+            # 顺序同ZjsnShip.strength_remain
+            remain = (numpy.array(top, dtype=numpy.int64) - numpy.array(current, dtype=numpy.int64))[:, [1, 3, 2, 0]]
+            return dict(zip(ids, map(tuple, remain.tolist())))
+        return {ship_id: ZjsnShip.strength_remain_of(c, t) for ship_id, c, t in zip(ids, current, top)}
+
+
+# 每条船在索引里的键, 用元组存比每条船一个dict省内存
+ShipIndexKeys = collections.namedtuple('ShipIndexKeys', ['type', 'evoCid', 'fleetId', 'status', 'cid', 'level'])
+
+
 class ZjsnUserShip(dict):
     """docstring for ZjsnUserShip"""
 
+    # 二级索引的名字, 索引内容是 key -> {ship_id: None}, 用dict保持船只进入船坞的顺序
+    index_names = ('type', 'evoCid', 'fleetId', 'status', 'cid')
+
     def __init__(self, *args, **kwargs):
-        super(ZjsnUserShip, self).__init__(*args, **kwargs)
+        super(ZjsnUserShip, self).__init__()
         self.shipNumTop = 0
+        self.emulator = None  # type: ZjsnEmulatorBase
+        self._indexes = {name: collections.defaultdict(dict) for name in self.index_names}
+        self._index_keys = {}  # ship_id -> index keys of the stored ship
+        self._level_keys = []  # sorted (-level, ship_id)
+        self._revision = 0  # 船只数据每次变化都加一, 用来判断缓存是否过期
+        self._card_revision = None  # 索引里的船型和evoCid对应的卡片版本
+        self._unique = None
+        self._unique_ids = set()
+        self._unique_revision = -1
+        self._columns = None
+        self._repair_times = None
+        self._strength_exps = None
+        self._columns_revision = -1
+        if args or kwargs:
+            for ship_id, ship in dict(*args, **kwargs).items():
+                self[ship_id] = ship
+
+    @staticmethod
+    def _keys_of(ship: 'ZjsnShip'):
+        card = ship.card
+        return ShipIndexKeys(ship.type, card['evoCid'] if card else None, int(ship.get('fleetId', 0)),
+                             int(ship.get('status', 0)), ship.cid, int(ship.get('level', 0)))
+
+    def _index(self, ship_id, ship):
+        new_keys = self._keys_of(ship)
+        old_keys = self._index_keys.get(ship_id)
+        if old_keys == new_keys:
+            return
+        self._unindex(ship_id, keep=new_keys)
+        for name in self.index_names:
+            self._indexes[name][getattr(new_keys, name)][ship_id] = None
+        if not old_keys or old_keys.level != new_keys.level:
+            bisect.insort(self._level_keys, (-new_keys.level, ship_id))
+        self._index_keys[ship_id] = new_keys
+
+    def _unindex(self, ship_id, keep=None):
+        """drop ship_id from the indexes, entries whose key equals keep are left in place"""
+        old_keys = self._index_keys.pop(ship_id, None)
+        if not old_keys:
+            return
+        for name in self.index_names:
+            if keep and getattr(keep, name) == getattr(old_keys, name):
+                continue
+            bucket = self._indexes[name][getattr(old_keys, name)]
+            bucket.pop(ship_id, None)
+            if not bucket:
+                del self._indexes[name][getattr(old_keys, name)]
+        if not keep or keep.level != old_keys.level:
+            level_key = (-old_keys.level, ship_id)
+            i = bisect.bisect_left(self._level_keys, level_key)
+            if i < len(self._level_keys) and self._level_keys[i] == level_key:
+                del self._level_keys[i]
+
+    def __setitem__(self, key, ship):
+        if type(ship) != ZjsnShip:
+            ship = ZjsnShip(ship)
+        old_ship = dict.get(self, key)
+        if old_ship != ship:
+            self._revision += 1
+        ship._emulator = self.emulator
+        if old_ship is not None and old_ship._strength_exp is not None and old_ship._card_info is ship._card_info and \
+                old_ship.get('strengthenAttribute') == ship.get('strengthenAttribute'):
+            ship._strength_exp = old_ship._strength_exp
+        super(ZjsnUserShip, self).__setitem__(key, ship)
+        self._index(key, ship)
+
+    def __delitem__(self, key):
+        super(ZjsnUserShip, self).__delitem__(key)
+        self._revision += 1
+        self._unindex(key)
+
+    def pop(self, key, *default):
+        if key in self.keys():
+            self._revision += 1
+            self._unindex(key)
+        return super(ZjsnUserShip, self).pop(key, *default)
+
+    def clear(self):
+        super(ZjsnUserShip, self).clear()
+        self._revision += 1
+        self._indexes = {name: collections.defaultdict(dict) for name in self.index_names}
+        self._index_keys = {}
+        self._level_keys = []
+
+    def _sync_cards(self):
+        """re-index type and evoCid and drop the caches derived from cards after the card data changed"""
+        if self._card_revision != _INIT_DATA_.card_revision:
+            for ship_id, ship in dict.items(self):
+                self._index(ship_id, ship)
+            self._card_revision = _INIT_DATA_.card_revision
+            self._revision += 1
+
+    def ids_by(self, index_name, key):
+        """ids of ships whose index_name equals key, index_name is one of index_names"""
+        self._sync_cards()
+        return list(self._indexes[index_name].get(key, ()))
+
+    def ids_by_type(self, ship_types):
+        if isinstance(ship_types, str):
+            ship_types = [ship_types]
+        self._sync_cards()
+        ids = []
+        for t in ship_types:
+            ids.extend(self._indexes['type'].get(t, ()))
+        return ids
+
+    def of_type(self, ship_types, reverse=True) -> 'List[ZjsnShip]':
+        """ships of ship_types sorted by level, cost grows with the result instead of the dock"""
+        ships = [dict.__getitem__(self, i) for i in self.ids_by_type(ship_types)]
+        ships.sort(key=lambda x: x["level"], reverse=reverse)
+        return ships
 
     def __getitem__(self, item) -> 'ZjsnShip':
         if type(item) == ZjsnShip:
@@ -287,17 +779,51 @@ class ZjsnUserShip(dict):
 
     def level_order(self, reverse=True) -> Iterator['ZjsnShip']:
         """sorted ship objects from z to a"""
-        return iter(sorted(self.values(), key=lambda x: x["level"], reverse=True))
+        level_keys = self._level_keys if reverse else reversed(self._level_keys)
+        return iter([dict.__getitem__(self, ship_id) for _, ship_id in level_keys])
 
-    @property
-    def unique(self):
+    def _update_unique(self):
+        self._sync_cards()
+        if self._unique_revision == self._revision:
+            return
         ships = []
-        ships_evoCid = []
+        ships_evoCid = set()
         for ship in sorted(self, key=lambda x: (x.can_evo or x.evolved, x.level, x.locked), reverse=True):
             if ship.evoCid not in ships_evoCid:
-                ships_evoCid.append(ship.evoCid)
+                ships_evoCid.add(ship.evoCid)
                 ships.append(ship)
-        return ships
+        self._unique = ships
+        self._unique_ids = {ship.id for ship in ships}
+        self._unique_revision = self._revision
+
+    @property
+    def columns(self) -> ShipColumns:
+        """columnar view of the ships, rebuilt when ship data changes"""
+        self._sync_cards()
+        if self._columns_revision != self._revision:
+            self._columns = ShipColumns(self)
+            self._repair_times = None
+            self._strength_exps = None
+            self._columns_revision = self._revision
+        return self._columns
+
+    def repair_times(self):
+        """{ship id: repair_time} of every ship, computed in one pass and cached until ship data changes"""
+        columns = self.columns
+        if self._repair_times is None:
+            self._repair_times = columns.repair_times()
+        return self._repair_times
+
+    @property
+    def unique(self):
+        """best ship of every evoCid, cached until ship data changes"""
+        self._update_unique()
+        return list(self._unique)
+
+    @property
+    def unique_ids(self):
+        self._update_unique()
+        return self._unique_ids
 
     def add_ship(self, ship_dict, ze: "ZjsnEmulator", source='get'):
         self.update(ship_dict)
@@ -312,10 +838,20 @@ class ZjsnUserShip(dict):
 
     def update(self, E=None, **F):
         if "id" in E:
-            super(ZjsnUserShip, self).update({E['id']: ZjsnShip(E)}, **F)
+            self[E['id']] = ZjsnShip(E)
         else:
-            new_dict = {ship['id']: ZjsnShip(ship) for ship in E}
-            super(ZjsnUserShip, self).update(new_dict, **F)
+            for ship in E:
+                self[ship['id']] = ZjsnShip(ship)
+        for ship_id, ship in F.items():
+            self[ship_id] = ship
+
+    def strength_exp_table(self):
+        """{ship id: strength_exp} of the ships with a known strengthenTop, computed for the whole dock at once
+        and cached until ship data changes"""
+        columns = self.columns
+        if self._strength_exps is None:
+            self._strength_exps = columns.strength_exps()
+        return self._strength_exps
 
     def broken_ships_id(self, broken_level=0):
         """broken level 0 : 擦伤, 1 : 中破,  2 : 大破"""
@@ -323,7 +859,9 @@ class ZjsnUserShip(dict):
 
     def broken_ships(self, broken_level=0):
         """broken level 0 : 擦伤, 1 : 中破,  2 : 大破"""
-        return [ship for ship in self if ship.should_be_repair(broken_level)]
+        ships = [dict.__getitem__(self, i) for i in self.columns.broken_ids(broken_level)]
+        # 修理状态跟着舰队状态变, 不能放进缓存
+        return [ship for ship in ships if ship.status != 2]
 
     def save(self, file_name='my_ships.md'):
         markdown_string = ""
@@ -359,6 +897,86 @@ class ZjsnUserShip(dict):
         return [self[i] for i in ships_id if i != 0]
 
 
+class ShipProps(collections.abc.MutableMapping):
+    """prop dict of a shipVO like battleProps, the values are kept in one array
+
+    ships with the same prop keys share one key -> position table, so a ship holds no per-prop objects"""
+    __slots__ = ('_positions', '_values')
+    _shapes = {}  # keys -> {key: position}
+    _sorted_positions = {}  # id of a {key: position} -> positions in the order of the sorted keys
+
+    def __init__(self, props):
+        self._store(props)
+
+    def _store(self, props):
+        keys = tuple(props)
+        positions = ShipProps._shapes.get(keys)
+        if positions is None:
+            positions = ShipProps._shapes.setdefault(keys, {k: i for i, k in enumerate(keys)})
+        self._positions = positions
+        values = list(props.values())
+        if all(type(v) is int for v in values):
+            try:
+                self._values = array.array('q', values)
+                return
+            except OverflowError:
+                pass
+        self._values = values
+
+    def __getitem__(self, key):
+        return self._values[self._positions[key]]
+
+    def __setitem__(self, key, value):
+        position = self._positions.get(key)
+        if position is not None and (type(value) is int or type(self._values) is list):
+            try:
+                self._values[position] = value
+                return
+            except OverflowError:
+                pass
+        # 新的键或者数组放不下的值, 换一个形状重新存
+        props = dict(self)
+        props[key] = value
+        self._store(props)
+
+    def __delitem__(self, key):
+        props = dict(self)
+        del props[key]
+        self._store(props)
+
+    def __iter__(self):
+        return iter(self._positions)
+
+    def __len__(self):
+        return len(self._positions)
+
+    def sorted_values(self):
+        """[v for _, v in sorted(self.items())] without going through __getitem__"""
+        order = ShipProps._sorted_positions.get(id(self._positions))
+        if order is None:
+            # 形状表一直留在_shapes里, id不会被复用
+            order = [position for _, position in sorted(self._positions.items())]
+            ShipProps._sorted_positions[id(self._positions)] = order
+        values = self._values
+        return [values[i] for i in order]
+
+    def __eq__(self, other):
+        if type(other) is ShipProps and other._positions is self._positions:
+            if type(self._values) is type(other._values):
+                return self._values == other._values
+            return list(self._values) == list(other._values)
+        return super(ShipProps, self).__eq__(other)
+
+    __hash__ = None
+
+    def __repr__(self):
+        return repr(dict(self))
+
+
+ShipCardInfo = collections.namedtuple(
+    'ShipCardInfo', ['card', 'name', 'type', 'star', 'evoCid', 'can_evo', 'evolved', 'evoLevel', 'strengthen_top'])
+
+
 class ZjsnShip(dict):
     """docstring for ZjsnUserShip"""
     type_list = ['航母',
@@ -389,10 +1007,82 @@ class ZjsnShip(dict):
                      10013512
                  ],  # 紫石英
 
-    emulator = None  # type: ZjsnEmulator
+    default_emulator = None  # type: ZjsnEmulatorBase
+
+    # 船只只多出指向共享卡片信息和所属模拟器的槽, 没有__dict__
+    __slots__ = ('_info', '_info_revision', '_strength_exp', '_emulator')
+    compact_fields = ('battleProps', 'battlePropsMax', 'battlePropsBasic', 'strengthenAttribute')
+    _card_info_cache = {}
+    _card_info_revision = None
 
     def __init__(self, *args, **kwargs):
         super(ZjsnShip, self).__init__(*args, **kwargs)
+        for key in self.compact_fields:
+            props = dict.get(self, key)
+            if type(props) is dict:
+                dict.__setitem__(self, key, ShipProps(props))
+        self._strength_exp = None
+        self._emulator = None
+        try:
+            self._info = self.card_info(self.cid)
+        except KeyError:
+            self._info = None
+        self._info_revision = _INIT_DATA_.card_revision
+
+    @property
+    def emulator(self) -> 'ZjsnEmulatorBase':
+        """emulator whose dock holds the ship, ships outside any dock use the last created emulator"""
+        return self._emulator or ZjsnShip.default_emulator
+
+    @staticmethod
+    def card_info(cid) -> 'ShipCardInfo':
+        """card-derived fields of cid, resolved once per card and shared by all ships with that cid"""
+        ship_card = _INIT_DATA_.ship_card
+        if ZjsnShip._card_info_revision != _INIT_DATA_.card_revision:
+            ZjsnShip._card_info_cache = {}
+            ZjsnShip._card_info_revision = _INIT_DATA_.card_revision
+        info = ZjsnShip._card_info_cache.get(cid)
+        if info is not None:
+            return info
+        if ship_card and cid in ship_card:
+            card = ship_card[cid]
+            try:
+                ship_type = ZjsnShip.type_list[ZjsnShip.type_id_list.index(int(card['type']))]
+            except ValueError:
+                ship_type = 0
+            evolved = int(card['evoClass'])
+            try:
+                if evolved:
+                    evo_level = int(ship_card[int(card['evoCid'])]['evoLevel'])
+                else:
+                    evo_level = int(card['evoLevel'])
+            except KeyError:
+                evo_level = None
+            strengthen_top = [v for _, v in sorted(card['strengthenTop'].items())] if 'strengthenTop' in card else None
+            info = ShipCardInfo(card, card['title'].replace(' ', ''), ship_type, int(card['star']),
+                                card['evoCid'], int(card['canEvo']), evolved, evo_level, strengthen_top)
+        else:
+            info = ShipCardInfo(0, "unknown ship {}".format(cid), 0, 99, None, None, None, None, None)
+        ZjsnShip._card_info_cache[cid] = info
+        return info
+
+    @property
+    def _card_info(self) -> 'ShipCardInfo':
+        """card info of the ship, resolved again when the card data changed since it was built"""
+        if self._info is None or self._info_revision != _INIT_DATA_.card_revision:
+            info = self.card_info(self.cid)
+            if info is not self._info:
+                self._strength_exp = None
+            self._info = info
+            self._info_revision = _INIT_DATA_.card_revision
+        return self._info
+
+    def _known_card_info(self) -> 'ShipCardInfo':
+        """like the old direct ship_card lookups, raise KeyError for ships without card"""
+        info = self._card_info
+        if not info.card:
+            raise KeyError(self.cid)
+        return info
 
     def __repr__(self):
         return self.name
@@ -418,10 +1108,7 @@ class ZjsnShip(dict):
 
     @property
     def name(self):
-        if self.cid in _INIT_DATA_.ship_card:
-            return _INIT_DATA_.ship_card[self.cid]['title'].replace(' ', '')
-        else:
-            return "unknown ship {}".format(self.cid)
+        return self._card_info.name
 
     @property
     def nick_name(self):
@@ -432,11 +1119,7 @@ class ZjsnShip(dict):
 
     @property
     def type(self):
-        if self.cid in _INIT_DATA_.ship_card:
-            type_trans_code = ZjsnShip.type_id_list.index(int(_INIT_DATA_.ship_card[self.cid]['type']))
-            return ZjsnShip.type_list[type_trans_code]
-        else:
-            return 0
+        return self._card_info.type
 
     @property
     def level(self):
@@ -459,24 +1142,18 @@ class ZjsnShip(dict):
 
     @property
     def evoLevel(self):
-        if self.evolved:
-            return int(_INIT_DATA_.ship_card[int(self.card['evoCid'])]['evoLevel'])
-        else:
-            return int(self.card['evoLevel'])
+        info = self._known_card_info()
+        if info.evoLevel is None:
+            raise KeyError(int(info.card['evoCid']))
+        return info.evoLevel
 
     @property
     def card(self):
-        if self.cid in _INIT_DATA_.ship_card:
-            return _INIT_DATA_.ship_card[self.cid]
-        else:
-            return 0
+        return self._card_info.card
 
     @property
     def star(self):
-        if self.cid in _INIT_DATA_.ship_card:
-            return int(_INIT_DATA_.ship_card[self.cid]['star'])
-        else:
-            return 99
+        return self._card_info.star
 
     def protected(self):
         conditions = (
@@ -500,12 +1177,27 @@ class ZjsnShip(dict):
 
     @property
     def strength_exp(self):
-        current_attribute = list(collections.OrderedDict(sorted(self['strengthenAttribute'].items())).values())
-        max_attribute = list(
-            collections.OrderedDict(sorted(_INIT_DATA_.ship_card[self.cid]['strengthenTop'].items())).values())
+        """remaining strengthen exp, cached until a shipVO with another strengthenAttribute arrives"""
+        max_attribute = self._known_card_info().strengthen_top
+        if self._strength_exp is None:
+            if max_attribute is None:
+                raise KeyError('strengthenTop')
+            self._strength_exp = self.strength_remain(self['strengthenAttribute'], max_attribute)
+        return self._strength_exp
+
+    @staticmethod
+    def strength_remain(strengthen_attribute, max_attribute):
+        if type(strengthen_attribute) is ShipProps:
+            current_attribute = strengthen_attribute.sorted_values()
+        else:
+            current_attribute = [v for _, v in sorted(strengthen_attribute.items())]
+        return ZjsnShip.strength_remain_of(current_attribute, max_attribute)
+
+    @staticmethod
+    def strength_remain_of(current_attribute, max_attribute):
+        """strength_remain from attribute lists in key order"""
         tmp = [m - c for m, c in zip(max_attribute, current_attribute)]
-        result = [tmp[1], tmp[3], tmp[2], tmp[0]]
-        return result
+        return tmp[1], tmp[3], tmp[2], tmp[0]
 
     @property
     def status(self):
@@ -530,15 +1222,15 @@ class ZjsnShip(dict):
 
     @property
     def can_evo(self):
-        return int(_INIT_DATA_.ship_card[self.cid]['canEvo'])
+        return self._known_card_info().can_evo
 
     @property
     def evoCid(self):
-        return _INIT_DATA_.ship_card[self.cid]['evoCid']
+        return self._known_card_info().evoCid
 
     @property
     def evolved(self):
-        return int(_INIT_DATA_.ship_card[self.cid]['evoClass'])
+        return self._known_card_info().evolved
 
     @property
     def fleet_id(self):
@@ -616,8 +1308,13 @@ class ZjsnTask(dict):
         return award_list
 
 
-class ZjsnEmulator(object):
-    """docstring for ZjsnEmulator"""
+class ZjsnEmulatorBase(object):
+    """account state and the helpers which send no request, shared by ZjsnEmulator and AsyncZjsnEmulator"""
+    # 回港刷新的部分 -> 之后会让它过期的接口
+    STALE_AFTER = {'campaign': ('/campaign/getWarResult',),
+                   'spoils': ('/pve/getWarResult', '/pevent/getWarResult'),
+                   }
+    REFRESH_PARTS = ('campaign', 'spoils', 'award')
     result_list = ['SSS',
                    'SS',
                    'S',
@@ -629,10 +1326,16 @@ class ZjsnEmulator(object):
     ENCODE_USERNAME_VERSION = distutils.version.LooseVersion("3.3.0")
 
     def __init__(self):
-        super(ZjsnEmulator, self).__init__()
-        ZjsnShip.emulator = self
-        self.s = requests.Session()
+        super(ZjsnEmulatorBase, self).__init__()
+        ZjsnShip.default_emulator = self
+        self._fleet = [{}]
+        self._pveExplore = [{}]
+        self._fleeted_ships_id = set()
+        self._explore_ships_id = set()
+        self.dock_revision = 0  # 远征, 修理, 建造的列表每次被替换都加一
+        self.transport = self.new_transport()
         self.userShip = ZjsnUserShip()
+        self.userShip.emulator = self
         self.task = ZjsnTask()
 
         self.repairDock = [{}]
@@ -663,6 +1366,8 @@ class ZjsnEmulator(object):
         self.api = ZjsnApi(None)
 
         self.common_lag = 25  # 远征和修理收取的延迟秒数
+        self.limiter = ztransport.RateLimiter()
+        self.metrics = zmetrics.ZjsnMetrics()
         self.operation_lag = 0.5  # 每次操作的延迟秒数
 
         self.node = 0
@@ -682,11 +1387,35 @@ class ZjsnEmulator(object):
         self.build_equipment_remain = 0
 
         self.last_request = None
-        self.last_request_time = 0
+        self.stale = set(self.REFRESH_PARTS)  # go_home要重新获取的部分
+        self.instant_repair_threshold = None  # 编队要用的船修理完成还要超过这么多秒就快修, None不快修
+        self.login_timings = collections.OrderedDict()  # 上次登录每个阶段的秒数
 
         self.version = distutils.version.LooseVersion("3.1.0")
         self.max_level = 100
 
+    def new_transport(self):
+        raise NotImplementedError()
+
+    @property
+    def operation_lag(self):
+        """seconds between two paced requests of this account"""
+        return self._operation_lag
+
+    @operation_lag.setter
+    def operation_lag(self, value):
+        self._operation_lag = value
+        self.limiter.set_account_rate(1 / value if value else None)
+
+    @property
+    def s(self):
+        """requests session of the transport"""
+        return self.transport.session
+
+    @s.setter
+    def s(self, value):
+        self.transport.session = value
+
     @property
     def working_ships_id(self):
         return self.fleet[int(self.working_fleet) - 1]["ships"]
@@ -702,111 +1431,149 @@ class ZjsnEmulator(object):
         return self.fleet[int(fleet_id) - 1]["ships"]
 
     @property
-    def fleeted_ships_id(self):
-        return itertools.chain.from_iterable([i['ships'] for i in self.fleet])
+    def fleet(self):
+        return self._fleet
+
+    @fleet.setter
+    def fleet(self, value):
+        self._fleet = value
+        self.update_fleet_index()
 
     @property
-    def explore_fleets(self):
-        return [int(e['fleetId']) for e in self.pveExplore]
+    def pveExplore(self):
+        return self._pveExplore
+
+    @pveExplore.setter
+    def pveExplore(self, value):
+        self._pveExplore = value
+        self.dock_revision += 1
+        self.update_fleet_index()
 
     @property
-    def explore_ships_id(self):
-        return [s.id for s in self.userShip if s.fleet_id in self.explore_fleets]
+    def repairDock(self):
+        return self._repairDock
 
-    def get(self, url, error_count=0, sleep_flag=True, method='GET', **kwargs):
-        """kwargs: sleep=True"""
-        if error_count:
-            time.sleep(error_count ** 3)
-        if error_count > 10:
-            raise ConnectionError("lost connection")
-        error_count += 1
+    @repairDock.setter
+    def repairDock(self, value):
+        self._repairDock = value
+        self.dock_revision += 1
 
-        if 'headers' in kwargs:
-            kwargs['headers'].update(self._default_headers)
-        else:
-            kwargs['headers'] = self._default_headers
+    @property
+    def dock(self):
+        return self._dock
 
-        try:
-            r = self.s.request(method, url, timeout=30, **kwargs)
-            self.last_request = r
-        except (
-                requests.exceptions.ConnectionError, requests.exceptions.Timeout,
-                requests.exceptions.ChunkedEncodingError):
-            return self.get(url, error_count, sleep_flag, method, **kwargs)
-        if sleep_flag:
-            t = self.operation_lag - (time.time() - self.last_request_time)
-            if t > 0:
-                time.sleep(t)
-            self.last_request_time = time.time()
+    @dock.setter
+    def dock(self, value):
+        self._dock = value
+        self.dock_revision += 1
 
+    @property
+    def equipmentDock(self):
+        return self._equipmentDock
+
+    @equipmentDock.setter
+    def equipmentDock(self, value):
+        self._equipmentDock = value
+        self.dock_revision += 1
+
+    def completion_times(self):
+        """(time, kind) of every running explore, repair and build, time already includes common_lag"""
+        times = []
+        for kind, docks in (('explore', self.pveExplore),
+                            ('repair', self.repairDock),
+                            ('build', self.dock),
+                            ('build_equipment', self.equipmentDock)):
+            for d in docks:
+                if 'endTime' in d:
+                    times.append((d['endTime'] + self.common_lag, kind))
+        return times
+
+    def update_fleet_index(self):
+        """rebuild the fleeted and exploring ship id sets, call it after changing a fleet in place"""
+        explore_fleets = set(self.explore_fleets)
+        self._fleeted_ships_id = set()
+        self._explore_ships_id = set()
+        for fleet_id, f in enumerate(self._fleet, 1):
+            ships_id = f.get('ships', ())
+            self._fleeted_ships_id.update(ships_id)
+            if fleet_id in explore_fleets:
+                self._explore_ships_id.update(ships_id)
 
-        try:
-            rj = r.json()
-        except:
-            return self.get(url, error_count, sleep_flag, method, **kwargs)
-
-        if r.status_code != 200:
-            return self.get(url, error_count, sleep_flag, method, **kwargs)
-        elif "eid" in rj:
-            eid = rj["eid"]
-            if eid == -1:  # 操作太快
-                zlogger.warning('操作太快, url: {}'.format(url))
-                time.sleep(self.operation_lag * 2)
-                return self.get(url, error_count, sleep_flag, method, **kwargs)
-            elif eid == -9999:  # 维护啦
-                zlogger.warning('服务器维护中')
-                time.sleep(30 * 60)
-                error_count -= 1
-                return self.get(url, error_count, sleep_flag, method, **kwargs)
-            else:
-                raise ZjsnError(_INIT_DATA_.error_code[str(eid)], rj["eid"], self.last_request.url)
-        else:
-            if "updateTaskVo" in rj:
-                for task in rj["updateTaskVo"]:
-                    if int(task["taskCid"]) in self.task:
-                        self.task[task["taskCid"]]["condition"] = task["condition"]
+    @property
+    def fleeted_ships_id(self):
+        return self._fleeted_ships_id
 
-            if method == 'POST':
-                return r
-            else:
-                return rj
+    @property
+    def explore_fleets(self):
+        return [int(e['fleetId']) for e in self.pveExplore if 'fleetId' in e]
 
-    def login(self):
-        r0 = self.get(self.api.checkVer())
-        # get client version
-        self.version = distutils.version.LooseVersion(r0["version"]["newVersionId"])
-        # check data version
-        if self.api.location == self.api.JAPAN:
-            i_v = _INIT_DATA_.version_japan
-        else:
-            i_v = _INIT_DATA_.version
-        if distutils.version.LooseVersion(r0["version"]['DataVersion']) > i_v:
-            self.update_data()
-        self.s = requests.Session()
+    @property
+    def explore_ships_id(self):
+        return self._explore_ships_id
+
+    def update_task_progress(self, rj):
+        if "updateTaskVo" in rj:
+            for task in rj["updateTaskVo"]:
+                if int(task["taskCid"]) in self.task:
+                    self.task[task["taskCid"]]["condition"] = task["condition"]
+                    if all(c["totalAmount"] == c["finishedAmount"] for c in task["condition"]):
+                        self.stale.add('award')
+
+    def mark_stale(self, url):
+        """parts of the go_home refresh which the response of url can change"""
+        path = zmetrics.endpoint_template(url)
+        for part, prefixes in self.STALE_AFTER.items():
+            if path.startswith(prefixes):
+                self.stale.add(part)
+
+    def apply_response(self, url, rj):
+        """account state every successful response can change"""
+        self.update_task_progress(rj)
+        self.mark_stale(url)
+
+    @property
+    def login_fanout(self):
+        """(url, sleep_flag) of the requests after initGame which do not depend on each other, sent concurrently"""
+        return [(self.url_server + "/pve/getPveData/", False),
+                (self.url_server + "/pevent/getPveData/", False),
+                (self.url_server + '/shop/getSpoilsShopList', True)]
+
+    def login_lap(self, phase, start):
+        """record the seconds since start as the timing of a login phase, returns the current time"""
+        now = time.time()
+        self.login_timings[phase] = now - start
+        return now
+
+    def log_login_timings(self):
+        zlogger.info('login timings: {}'.format(
+            ', '.join('{} {:.3f}s'.format(phase, t) for phase, t in self.login_timings.items())))
+
+    def passport_form(self):
         if self.version >= self.ENCODE_USERNAME_VERSION:
             username = base64.encodebytes(self.username.encode())
             password = base64.encodebytes(self.password.encode())
         else:
             username = self.username
             password = self.password
-        r1 = self.get(self.api.passport(), method='POST',
-                      sleep_flag=False,
-                      data={"username": username,
-                            "pwd": password})
-        self.s.cookies = requests.utils.cookiejar_from_dict(dict(r1.cookies))
-        self.s.cookies.update({'path': '/'})
-        defaultServer = r1.json()['defaultServer']
-        server_json = next(filter(lambda x: x['id'] == defaultServer, r1.json()['serverList']))
+        return {"username": username,
+                "pwd": password}
+
+    def use_server(self, passport):
+        """switch to the default server of the passport response, returns the server info"""
+        defaultServer = passport['defaultServer']
+        server_json = next(filter(lambda x: x['id'] == defaultServer, passport['serverList']))
         self.url_server = server_json['host'][:-1]
         self.api.host = self.url_server
         # 亲测userID没有作用，决定登陆哪个账号的是cookie
-        self.uid = r1.json()["userId"]
-        self.get(self.api.login(self.uid), sleep_flag=False)
-        self.initGame = self.get(self.api.init(), sleep_flag=False)
-        self.get(self.url_server + "/pve/getPveData/", sleep_flag=False)
-        event_data = self.get(self.url_server + "/pevent/getPveData/", sleep_flag=False)
+        self.uid = passport["userId"]
+        return server_json
 
-        j = self.initGame
+    def prune_init_game(self):
+        """drop the parts of initGame copied into the account state, the ship list is the biggest one"""
+        self.initGame.pop("userShipVO", None)
+
+    def load_init_game(self, j):
+        """set the account state from the initGame response"""
         self.userShip.clear()
         self.userShip.update(j["userShipVO"])
         self.userShip.shipNumTop = j['userVo']['detailInfo']['shipNumTop']
@@ -829,13 +1596,297 @@ class ZjsnEmulator(object):
         self.equipment = j['equipmentVo']
         self.task.update(j['taskVo'])
 
-        self.spoils = int(self.get(self.url_server + '/shop/getSpoilsShopList')['spoils'])
+    @property
+    def tz(self):
+        if self.api.location == self.api.CHINA:
+            timezone = datetime.timezone(datetime.timedelta(hours=8))
+        elif self.api.location == self.api.JAPAN:
+            timezone = datetime.timezone(datetime.timedelta(hours=9))
+        else:
+            timezone = datetime.datetime.now(datetime.timezone.utc).astimezone().tzinfo
+        return timezone
+
+    @property
+    def now(self):
+        return datetime.datetime.now(self.tz)
+
+    def fleet_candidates(self, ship_group_info):
+        """(ship id, evoCid) a slot can use without repair, in the order of the group, one ship per evoCid"""
+        ship_group, b_level, instant_flag = ship_group_info
+        candidates = []
+        evo_cids = set()
+        for s in self.userShip.select(ship_group):
+            if s.locked and s.fleet_able and s.status != 2 and not s.should_be_repair(b_level) and \
+                    s.evoCid not in evo_cids:
+                evo_cids.add(s.evoCid)
+                candidates.append((s.id, s.evoCid))
+        return candidates
+
+    def instant_candidates(self, ship_group_info):
+        """(ship id, evoCid) of broken ships a slot can use after an instant repair"""
+        ship_group, b_level, instant_flag = ship_group_info
+        candidates = []
+        evo_cids = set()
+        for s in self.userShip.select(ship_group):
+            if s.locked and s.fleet_able and s.is_broken(0) and s.evoCid not in evo_cids:
+                evo_cids.add(s.evoCid)
+                candidates.append((s.id, s.evoCid))
+        return candidates
+
+    @staticmethod
+    def assign_fleet(candidates):
+        """one (ship id, evoCid) of every slot with no evoCid twice, None when there is none
+
+        every slot in turn gets its first candidate which still leaves the later slots a full fleet"""
+        # 贪心能排满就直接用
+        fleet = []
+        used = set()
+        for slot in candidates:
+            pick = next((c for c in slot if c[1] not in used), None)
+            if pick is None:
+                break
+            fleet.append(pick)
+            used.add(pick[1])
+        else:
+            return fleet
+
+        fleet = []
+        used = set()
+        for i, slot in enumerate(candidates):
+            for c in slot:
+                if c[1] not in used and ZjsnEmulatorBase.can_fill(candidates[i + 1:], used | {c[1]}):
+                    fleet.append(c)
+                    used.add(c[1])
+                    break
+            else:
+                return None
+        return fleet
+
+    @staticmethod
+    def can_fill(candidates, used):
+        """whether every slot can get its own evoCid outside used, Kuhn's augmenting path matching"""
+        owner = {}  # evoCid -> slot
+
+        def augment(slot, seen):
+            for ship_id, evo_cid in candidates[slot]:
+                if evo_cid in used or evo_cid in seen:
+                    continue
+                seen.add(evo_cid)
+                if evo_cid not in owner or augment(owner[evo_cid], seen):
+                    owner[evo_cid] = slot
+                    return True
+            return False
+
+        return all(augment(slot, set()) for slot in range(len(candidates)))
+
+    def repair_queue(self, broken_level=0, avoid_working_flag=False):
+        """ids of ships waiting for a repair dock, the next one to repair is at the end
+
+        ships the ship_groups are waiting for go first, the longest repair first so that the last of them
+        is ready as early as possible, the other ships follow with the shortest repair first"""
+        if avoid_working_flag:
+            avoid_ships_id = self.explore_ships_id | set(self.working_ships_id)
+        else:
+            avoid_ships_id = self.explore_ships_id
+
+        ships = [i.id for i in self.userShip.broken_ships(broken_level) if
+                 i.status == 0 and i.id not in avoid_ships_id]
+        critical = self.critical_ships_id() & set(ships)
+        repair_times = self.userShip.repair_times()
+
+        def order(ship_id):
+            t = repair_times[ship_id]
+            return (True, t) if ship_id in critical else (False, -t)
+
+        ships.sort(key=order)
+        return ships
+
+    def critical_ships_id(self):
+        """broken ships which ship_groups need to fill the fleet, the quickest ones of every group"""
+        slots = collections.OrderedDict()
+        for group in self.ship_groups:
+            if group and group[0]:
+                key = tuple(group[0])
+                need, level = slots.get(key, (0, 0))
+                slots[key] = (need + 1, max(level, group[1]))
+
+        critical = set()
+        repair_times = self.userShip.repair_times()
+        for key, (need, b_level) in slots.items():
+            usable = 0
+            broken = []
+            for s in self.userShip.select(i for i in key if i in self.userShip):
+                if not (s.locked and s.fleet_able):
+                    continue
+                if s.status != 2 and not s.should_be_repair(b_level):
+                    usable += 1
+                elif s.status == 0 and s.id not in critical:
+                    broken.append(s)
+            broken.sort(key=lambda x: repair_times[x.id])
+            critical.update(s.id for s in broken[:max(0, need - usable)])
+        return critical
+
+    def repair_plan(self, ships):
+        """(ship id, seconds until it is repaired) of the queue in repair order,
+        busy docks take the next ship when their repair ends"""
+        now = time.time()
+        docks = [max(0, dock["endTime"] + self.common_lag - now) if "endTime" in dock else 0
+                 for dock in self.repairDock if not dock.get("locked")]
+        heapq.heapify(docks)
+        plan = []
+        if not docks:
+            return plan
+        repair_times = self.userShip.repair_times()
+        for ship_id in reversed(ships):
+            end = heapq.heappop(docks) + repair_times[ship_id]
+            heapq.heappush(docks, end)
+            plan.append((ship_id, end))
+        return plan
+
+    def instant_repair_choice(self, ships):
+        """critical ships of the queue which would wait longer than instant_repair_threshold for a dock"""
+        if self.instant_repair_threshold is None:
+            return []
+        critical = self.critical_ships_id()
+        return [ship_id for ship_id, end in self.repair_plan(ships)
+                if ship_id in critical and end > self.instant_repair_threshold]
+
+    def war_report(self):
+        pass
+
+    def unlocked_report(self):
+        base_ships = [_INIT_DATA_.ship_card[s_id]['title'] for s_id in
+                      (set(_INIT_DATA_.ship_card) - set(self.unlockShip))
+                      if s_id < 11000000]
+        evo_ships = [_INIT_DATA_.ship_card[s_id]['title'] for s_id in
+                     (set(_INIT_DATA_.ship_card) - set(self.unlockShip))
+                     if 11000000 < s_id < 18000000]
+        zlogger.info("unlocked base ships:\n{}".format('\n'.join(base_ships)))
+        zlogger.info("unlocked evo ships:\n{}".format('\n'.join(evo_ships)))
+
+
+class ZjsnEmulator(ZjsnEmulatorBase):
+    """docstring for ZjsnEmulator"""
+
+    def new_transport(self):
+        return ztransport.ZjsnTransport()
+
+    def get(self, url, error_count=0, sleep_flag=True, method='GET', apply_state=True, **kwargs):
+        """requests always pass the host limiter, sleep_flag=False skips the account pacing until 操作太快
 
-        if j['marketingData']['continueLoginAward']['canGetDay'] != -1:
+        apply_state=False leaves apply_response to the caller"""
+        paced = sleep_flag
+        if 'headers' in kwargs:
+            kwargs['headers'].update(self._default_headers)
+        else:
+            kwargs['headers'] = self._default_headers
+
+        while True:
+            if error_count:
+                self.metrics.retry(url)
+                time.sleep(self.transport.backoff(error_count))
+            if error_count > self.transport.max_retries:
+                raise ConnectionError("lost connection")
+            error_count += 1
+
+            wait = self.limiter.reserve(url, paced)
+            if wait > 0:
+                time.sleep(wait)
+            request_start = time.perf_counter()
+            try:
+                r = self.transport.request(method, url, **kwargs)
+                self.last_request = r
+            except (
+                    requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                    requests.exceptions.ChunkedEncodingError, requests.exceptions.ContentDecodingError):
+                self.metrics.transport_error(url)
+                continue
+            self.metrics.observe(url, time.perf_counter() - request_start, len(r.content), r.status_code)
+
+            try:
+                rj = ztransport.loads(r.content)
+            except ValueError:
+                continue
+
+            if r.status_code != 200:
+                continue
+            elif "eid" in rj:
+                eid = rj["eid"]
+                self.metrics.error(url, eid)
+                if eid == -1:  # 操作太快
+                    zlogger.warning('操作太快, url: {}'.format(url))
+                    self.limiter.too_fast(url)
+                    paced = True
+                    continue
+                elif eid == -9999:  # 维护啦
+                    zlogger.warning('服务器维护中')
+                    time.sleep(30 * 60)
+                    error_count -= 1
+                    continue
+                else:
+                    raise ZjsnError(_INIT_DATA_.error_code[str(eid)], rj["eid"], r.url)
+            else:
+                self.limiter.success(url)
+                if apply_state:
+                    self.apply_response(url, rj)
+
+                if method == 'POST':
+                    return r
+                else:
+                    return rj
+
+    def login(self):
+        self.login_timings = collections.OrderedDict()
+        login_start = lap = time.time()
+        r0 = self.get(self.api.checkVer())
+        # get client version
+        self.version = distutils.version.LooseVersion(r0["version"]["newVersionId"])
+        # check data version
+        if self.api.location == self.api.JAPAN:
+            i_v = _INIT_DATA_.version_japan
+        else:
+            i_v = _INIT_DATA_.version
+        lap = self.login_lap('checkVer', lap)
+        if distutils.version.LooseVersion(r0["version"]['DataVersion']) > i_v:
+            self.update_data()
+            lap = self.login_lap('update_data', lap)
+        # 只换cookie, 连接池里的keep-alive连接继续用
+        self.transport.reset_cookies()
+        r1 = self.get(self.api.passport(), method='POST',
+                      sleep_flag=False,
+                      data=self.passport_form())
+        self.s.cookies = requests.utils.cookiejar_from_dict(dict(r1.cookies))
+        self.s.cookies.update({'path': '/'})
+        server_json = self.use_server(r1.json())
+        lap = self.login_lap('passport', lap)
+        # 服务器要求按顺序登录和初始化, 之后的几个请求互不依赖
+        self.get(self.api.login(self.uid), sleep_flag=False)
+        lap = self.login_lap('login', lap)
+        self.initGame = self.get(self.api.init(), sleep_flag=False)
+        lap = self.login_lap('initGame', lap)
+
+        fanout = self.login_fanout
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(fanout)) as pool:
+            # 线程里只发请求, 任务进度和stale等initGame解析完再在这里更新
+            futures = [pool.submit(self.get, url, sleep_flag=sleep_flag, apply_state=False) for url, sleep_flag in fanout]
+            self.load_init_game(self.initGame)
+            self.prune_init_game()
+            results = [f.result() for f in futures]
+        for (url, sleep_flag), rj in zip(fanout, results):
+            self.apply_response(url, rj)
+        pve_data, event_data, spoils_data = results
+        self.spoils = int(spoils_data['spoils'])
+        lap = self.login_lap('fanout', lap)
+
+        if self.initGame['marketingData']['continueLoginAward']['canGetDay'] != -1:
             r = self.get(self.api.loginAward())
             if 'shipVO' in r:
                 self.userShip.add_ship(r['shipVO'], ze=self)
+            lap = self.login_lap('loginAward', lap)
         self.login_time = self.now
+        self.stale.update(self.REFRESH_PARTS)
+        self.login_lap('total', login_start)
+        self.log_login_timings()
 
         self.userShip.save('{}_{}.md'.format(self.username, server_json['name']))
 
@@ -847,31 +1898,27 @@ class ZjsnEmulator(object):
     def update_data(self):
         r_data = self.get(self.api.get_init())
         _INIT_DATA_.update(r_data, japan=self.api.location == self.api.JAPAN)
-    def go_home(self):
+
+    def go_home(self, minimal=False):
+        """回港, minimal只放弃当前战斗, 不刷新战役次数, 胖次和任务奖励, 给SL用
+
+        战役次数, 胖次和任务奖励只在self.stale里有的时候才刷新"""
         self.relogin()
         r_sl = self.get(self.url_server + "/active/getUserData/", sleep_flag=False)
         r_sl = self.get(self.url_server + "/pve/getUserData/", sleep_flag=False)
-        self.get_campaign_data()
-        self.bsea()
-        self.get_award()
+        if minimal:
+            return
+        if 'campaign' in self.stale:
+            self.get_campaign_data()
+        if 'spoils' in self.stale:
+            self.bsea()
+        if 'award' in self.stale:
+            self.get_award()
 
     def get_campaign_data(self):
         r_c = self.get(self.url_server + "/campaign/getUserData/", sleep_flag=False)
         self.campaign_num = int(r_c['passInfo']['remainNum'])
-
-    @property
-    def tz(self):
-        if self.api.location == self.api.CHINA:
-            timezone = datetime.timezone(datetime.timedelta(hours=8))
-        elif self.api.location == self.api.JAPAN:
-            timezone = datetime.timezone(datetime.timedelta(hours=9))
-        else:
-            timezone = datetime.datetime.now(datetime.timezone.utc).astimezone().tzinfo
-        return timezone
-
-    @property
-    def now(self):
-        return datetime.datetime.now(self.tz)
+        self.stale.discard('campaign')
 
     def relogin(self):
         if self.login_time < self.now.replace(hour=6, minute=0, second=0) < self.now:
@@ -889,6 +1936,7 @@ class ZjsnEmulator(object):
     def bsea(self):
         r = self.get(self.api.bsea())
         self.todaySpoilsNum = int(r["bSeaData"]["todaySpoilsNum"])
+        self.stale.discard('spoils')
         return r
 
     def build(self, dock_id, oil, ammo, steel, aluminum):
@@ -911,17 +1959,33 @@ class ZjsnEmulator(object):
                 self.task.update(r['taskVo'])
             if 'shipVO' in r:
                 self.userShip.add_ship(r['shipVO'], ze=self)
+        if not self.task.finished_tasks:
+            self.stale.discard('award')
 
     def change_ships(self):
+        """fill the working fleet from ship_groups, all slots are solved together so that
+        an early slot does not take the only ship a later slot could use"""
         ship_groups = [i for i in self.ship_groups if i[0] != None]
-        tmp_fleet_ships_id = []
         for i, g in enumerate(ship_groups):
-            new_id = self.get_substitue(i, tmp_fleet_ships_id, g)
-            if new_id:
-                tmp_fleet_ships_id.append(new_id)
-            else:
+            if not g[0]:
+                zlogger.info("no ship to use in location {}".format(i))
                 return False
 
+        candidates = [self.fleet_candidates(g) for g in ship_groups]
+        fleet = self.assign_fleet(candidates)
+        if fleet is None:
+            # 不快修排不出编队时, 才把允许快修的位置上的破损船加进来
+            instant_candidates = [self.instant_candidates(g) if g[2] else [] for g in ship_groups]
+            fleet = self.assign_fleet([c + i_c for c, i_c in zip(candidates, instant_candidates)])
+            if fleet is None:
+                zlogger.debug("no ship to use for ship groups")
+                return False
+            # 只快修从本位置快修候选里选出的船, 别的位置的快修候选在这里可能只是轻伤
+            for pick, normal in zip(fleet, candidates):
+                if pick not in normal:
+                    self.repair(pick[0], 0, instant=True)
+
+        tmp_fleet_ships_id = [ship_id for ship_id, _ in fleet]
         if tmp_fleet_ships_id != self.working_ships_id:
             new_fleet = tmp_fleet_ships_id[:len(ship_groups)]
             self.instant_workingfleet(new_fleet)
@@ -990,6 +2054,7 @@ class ZjsnEmulator(object):
             else:
                 f = r["fleetVo"][fleet_id - 1]
             self.fleet[fleet_id - 1] = f
+            self.update_fleet_index()
             self.userShip.update(r['shipVO'])
             return r
 
@@ -1017,15 +2082,16 @@ class ZjsnEmulator(object):
 
     def auto_strengthen(self):
         # cid_table = [ship.cid for ship in self.userShip if ship.level > 1]
-        u_ships = self.userShip.unique
+        u_ships_id = self.userShip.unique_ids
+        strength_exps = self.userShip.strength_exp_table()
         for ship in sorted(self.userShip, key=lambda x: (bool(x.evolved), int(x.level)), reverse=True):
             self.auto_skill(ship)
             conditions = (
                 ship.locked == 1,
                 not (ship.name in ['罗德尼', '纳尔逊', '大凤', '空想', '萤火虫'] and ship.level < ship.evoLevel + 10),
-                (not ship.can_evo and ship in u_ships) or ship.evolved == 1 or ship.type in ['潜艇', '炮潜'],  # 不能改造或者已经改造
+                (not ship.can_evo and ship.id in u_ships_id) or ship.evolved == 1 or ship.type in ['潜艇', '炮潜'],  # 不能改造或者已经改造
                 ship.fleet_id not in self.explore_fleets,  # 不在远征舰队中
-                any(ship.strength_exp),
+                any(strength_exps.get(ship.id, ())),
             )
             if all(conditions):
                 r = self.strengthen(ship)
@@ -1219,7 +2285,6 @@ class ZjsnEmulator(object):
                 dock_id = i['id']
                 self.build(dock_id, *self.boat_formula)
                 self.build_boat_remain -= 1
-        self.dismantle()
 
     def auto_build_equipment(self):
         for ex in filter(lambda d: 'endTime' in d, self.equipmentDock):
@@ -1249,15 +2314,11 @@ class ZjsnEmulator(object):
     def repair_all(self, broken_level=0, instant=False, avoid_working_flag=False):
         """broken level 0 : 擦伤, 1 : 中破,  2 : 大破
         不会修理正在远征和修理的船"""
-        if avoid_working_flag:
-            avoid_ships_id = self.explore_ships_id + self.working_ships_id
-        else:
-            avoid_ships_id = self.explore_ships_id
-
-        ships = [i.id for i in self.userShip.broken_ships(broken_level) if
-                 i.status == 0 and i.id not in avoid_ships_id]
-        # 先修时间最短的
-        ships.sort(key=lambda x: self.userShip[x].repair_time, reverse=True)
+        ships = self.repair_queue(broken_level, avoid_working_flag)
+        if not instant:
+            for ship_id in self.instant_repair_choice(ships):
+                ships.remove(ship_id)
+                self.repair(ship_id, 0, instant=True)
         for dock_index, dock in enumerate(self.repairDock):
             if "endTime" in dock:
                 if dock["endTime"] + self.common_lag < time.time():
@@ -1414,19 +2475,6 @@ class ZjsnEmulator(object):
         r = self.get(self.api.skip())
         return r['isSuccess']
 
-    def war_report(self):
-        pass
-
-    def unlocked_report(self):
-        base_ships = [_INIT_DATA_.ship_card[s_id]['title'] for s_id in
-                      (set(_INIT_DATA_.ship_card) - set(self.unlockShip))
-                      if s_id < 11000000]
-        evo_ships = [_INIT_DATA_.ship_card[s_id]['title'] for s_id in
-                     (set(_INIT_DATA_.ship_card) - set(self.unlockShip))
-                     if 11000000 < s_id < 18000000]
-        zlogger.info("unlocked base ships:\n{}".format('\n'.join(base_ships)))
-        zlogger.info("unlocked evo ships:\n{}".format('\n'.join(evo_ships)))
-
     def rename_ship(self, ship_id, new_name):
         r = self.get(self.api.rename(ship_id, new_name))
         if 'shipVO' in r:
@@ -0,0 +1,410 @@
+#!/usr/bin/env python3
+import asyncio
+import collections
+import distutils.version
+import logging
+import time
+import zlib
+
+import aiohttp
+
+import ztransport
+from zemulator import ZjsnEmulatorBase, ZjsnError, _INIT_DATA_
+
+zlogger = logging.getLogger('zjsn.zrobot.zemulator_async')
+
+
+class AsyncResponse(collections.namedtuple('AsyncResponse', ['url', 'status_code', 'cookies', 'content'])):
+    """body and headers of a finished aiohttp request, quacks like requests.Response where the emulator needs it"""
+
+    def json(self):
+        return ztransport.loads(self.content)
+
+
+class AsyncZjsnTransport(ztransport.ZjsnTransport):
+    """aiohttp transport of AsyncZjsnEmulator, the session is opened on the running event loop"""
+
+    def new_session(self):
+        return None
+
+    def open(self):
+        if self.session is None or self.session.closed:
+            # unsafe cookie jar也接受ip地址的host
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.pool_maxsize, limit_per_host=self.pool_maxsize),
+                cookie_jar=aiohttp.CookieJar(unsafe=True),
+                timeout=aiohttp.ClientTimeout(sock_connect=self.connect_timeout, sock_read=self.read_timeout))
+        return self.session
+
+    async def close(self):
+        if self.session is not None and not self.session.closed:
+            await self.session.close()
+        self.session = None
+
+    def reset_cookies(self):
+        if self.session is not None:
+            self.session.cookie_jar.clear()
+
+    def set_cookies(self, cookies):
+        """cookies sent to every host, like a requests session without cookie domains"""
+        self.open().cookie_jar.update_cookies(cookies)
+
+    async def request(self, method, url, **kwargs):
+        kwargs['headers'] = self.request_headers(kwargs.get('headers'))
+        async with self.open().request(method, url, **kwargs) as r:
+            if self.compressed and ztransport.is_compressed(r.headers.get('Content-Type', '')):
+                d = zlib.decompressobj()
+                body = []
+                async for chunk in r.content.iter_chunked(self.chunk_size):
+                    body.append(d.decompress(chunk))
+                body.append(d.flush())
+                content = b''.join(body)
+            else:
+                content = await r.read()
+            return AsyncResponse(str(r.url), r.status, {k: v.value for k, v in r.cookies.items()}, content)
+
+
+class AsyncZjsnEmulator(ZjsnEmulatorBase):
+    """ZjsnEmulator driven by an event loop, many accounts can share one thread
+
+    the account state and the local helpers are shared with ZjsnEmulator through ZjsnEmulatorBase,
+    every method sending a request is a coroutine. request methods of ZjsnEmulator not ported here
+    do not exist on this class"""
+
+    def new_transport(self):
+        return AsyncZjsnTransport()
+
+    async def close(self):
+        await self.transport.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    async def get(self, url, error_count=0, sleep_flag=True, method='GET', apply_state=True, **kwargs):
+        """requests always pass the host limiter, sleep_flag=False skips the account pacing until 操作太快
+
+        apply_state=False leaves apply_response to the caller"""
+        paced = sleep_flag
+        if 'headers' in kwargs:
+            kwargs['headers'].update(self._default_headers)
+        else:
+            kwargs['headers'] = self._default_headers
+
+        while True:
+            if error_count:
+                self.metrics.retry(url)
+                await asyncio.sleep(self.transport.backoff(error_count))
+            if error_count > self.transport.max_retries:
+                raise ConnectionError("lost connection")
+            error_count += 1
+
+            wait = self.limiter.reserve(url, paced)
+            if wait > 0:
+                await asyncio.sleep(wait)
+            request_start = time.perf_counter()
+            try:
+                r = await self.transport.request(method, url, **kwargs)
+                self.last_request = r
+            except (aiohttp.ClientError, asyncio.TimeoutError, zlib.error):
+                self.metrics.transport_error(url)
+                continue
+            self.metrics.observe(url, time.perf_counter() - request_start, len(r.content), r.status_code)
+
+            try:
+                rj = ztransport.loads(r.content)
+            except ValueError:
+                continue
+
+            if r.status_code != 200:
+                continue
+            elif "eid" in rj:
+                eid = rj["eid"]
+                self.metrics.error(url, eid)
+                if eid == -1:  # 操作太快
+                    zlogger.warning('操作太快, url: {}'.format(url))
+                    self.limiter.too_fast(url)
+                    paced = True
+                    continue
+                elif eid == -9999:  # 维护啦
+                    zlogger.warning('服务器维护中')
+                    await asyncio.sleep(30 * 60)
+                    error_count -= 1
+                    continue
+                else:
+                    raise ZjsnError(_INIT_DATA_.error_code[str(eid)], rj["eid"], r.url)
+            else:
+                self.limiter.success(url)
+                if apply_state:
+                    self.apply_response(url, rj)
+
+                if method == 'POST':
+                    return r
+                else:
+                    return rj
+
+    async def login(self):
+        self.login_timings = collections.OrderedDict()
+        login_start = lap = time.time()
+        r0 = await self.get(self.api.checkVer())
+        self.version = distutils.version.LooseVersion(r0["version"]["newVersionId"])
+        if self.api.location == self.api.JAPAN:
+            i_v = _INIT_DATA_.version_japan
+        else:
+            i_v = _INIT_DATA_.version
+        lap = self.login_lap('checkVer', lap)
+        if distutils.version.LooseVersion(r0["version"]['DataVersion']) > i_v:
+            await self.update_data()
+            lap = self.login_lap('update_data', lap)
+        self.transport.reset_cookies()
+        # aiohttp会把bytes的表单值当成文件上传
+        form = {k: v.decode() if isinstance(v, bytes) else v for k, v in self.passport_form().items()}
+        r1 = await self.get(self.api.passport(), method='POST', sleep_flag=False, data=form)
+        self.transport.reset_cookies()
+        # requests版本多塞的path cookie是http.cookies的保留字, 这里只带服务器给的cookie
+        self.transport.set_cookies(r1.cookies)
+        server_json = self.use_server(r1.json())
+        lap = self.login_lap('passport', lap)
+        await self.get(self.api.login(self.uid), sleep_flag=False)
+        lap = self.login_lap('login', lap)
+        self.initGame = await self.get(self.api.init(), sleep_flag=False)
+        lap = self.login_lap('initGame', lap)
+
+        fanout = self.login_fanout
+        pending = asyncio.ensure_future(asyncio.gather(
+            *[self.get(url, sleep_flag=sleep_flag, apply_state=False) for url, sleep_flag in fanout]))
+        # aiohttp要跑好几轮事件循环才把请求发出去, initGame放到线程里解析才能和请求重叠
+        # 任务进度和stale等解析完再更新
+        await asyncio.get_running_loop().run_in_executor(None, self.load_init_game, self.initGame)
+        self.prune_init_game()
+        results = await pending
+        for (url, sleep_flag), rj in zip(fanout, results):
+            self.apply_response(url, rj)
+        pve_data, event_data, spoils_data = results
+        self.spoils = int(spoils_data['spoils'])
+        lap = self.login_lap('fanout', lap)
+
+        if self.initGame['marketingData']['continueLoginAward']['canGetDay'] != -1:
+            r = await self.get(self.api.loginAward())
+            if 'shipVO' in r:
+                await self.add_ship(r['shipVO'])
+            lap = self.login_lap('loginAward', lap)
+        self.login_time = self.now
+        self.stale.update(self.REFRESH_PARTS)
+        self.login_lap('total', login_start)
+        self.log_login_timings()
+
+        self.userShip.save('{}_{}.md'.format(self.username, server_json['name']))
+
+        if self.version >= self.ENCODE_USERNAME_VERSION:
+            self.max_level = 110
+        zlogger.debug("login finished")
+        return True
+
+    async def update_data(self):
+        r_data = await self.get(self.api.get_init())
+        _INIT_DATA_.update(r_data, japan=self.api.location == self.api.JAPAN)
+
+    async def relogin(self):
+        if self.login_time < self.now.replace(hour=6, minute=0, second=0) < self.now:
+            await self.login()
+            return True
+        if self.login_time < self.now.replace(hour=0, minute=0, second=0) < self.now:
+            await self.login()
+            self.drop500 = False
+            return True
+        return False
+
+    async def go_home(self, minimal=False):
+        await self.relogin()
+        await self.get(self.url_server + "/active/getUserData/", sleep_flag=False)
+        await self.get(self.url_server + "/pve/getUserData/", sleep_flag=False)
+        if minimal:
+            return
+        if 'campaign' in self.stale:
+            await self.get_campaign_data()
+        if 'spoils' in self.stale:
+            await self.bsea()
+        if 'award' in self.stale:
+            await self.get_award()
+
+    async def get_campaign_data(self):
+        r_c = await self.get(self.url_server + "/campaign/getUserData/", sleep_flag=False)
+        self.campaign_num = int(r_c['passInfo']['remainNum'])
+        self.stale.discard('campaign')
+
+    async def bsea(self):
+        r = await self.get(self.api.bsea())
+        self.todaySpoilsNum = int(r["bSeaData"]["todaySpoilsNum"])
+        self.stale.discard('spoils')
+        return r
+
+    async def lock(self, ship_id):
+        r = await self.get(self.api.lock(ship_id))
+        self.userShip.update(r['shipVO'])
+        return r
+
+    async def add_ship(self, ship_dict, source='get'):
+        self.userShip.update(ship_dict)
+        if "id" in ship_dict:
+            ship_dict = [ship_dict]
+        for s in ship_dict:
+            ship = self.userShip[s['id']]
+            if ship.cid not in self.unlockShip:
+                await self.lock(ship.id)
+                self.unlockShip.append(ship.cid)
+                zlogger.info("{} new ship {}".format(source, ship.name))
+            else:
+                zlogger.info("{} {}".format(source, ship.name))
+
+    async def get_award(self):
+        for task_cid in self.task.finished_tasks:
+            zlogger.debug("task: {} finish".format(self.task[task_cid]["title"]))
+            r = await self.get(self.api.getAward(task_cid))
+            self.task.remove(task_cid)
+            if 'taskVo' in r:
+                self.task.update(r['taskVo'])
+            if 'shipVO' in r:
+                await self.add_ship(r['shipVO'])
+        if not self.task.finished_tasks:
+            self.stale.discard('award')
+
+    async def explore(self, fleet_id, explore_id):
+        r = await self.get(self.api.explore(fleet_id, explore_id))
+        self.pveExplore = r["pveExploreVo"]["levels"]
+        self.fleet = r["fleetVo"]
+
+    async def explore_result(self, explore_id):
+        r = await self.get(self.api.getExploreResult(explore_id))
+        self.pveExplore = r["pveExploreVo"]["levels"]
+        self.fleet = r["fleetVo"]
+        return r
+
+    def finished_explore(self):
+        return [(ex["fleetId"], ex["exploreId"]) for ex in self.pveExplore
+                if "endTime" in ex and ex["endTime"] + self.common_lag < time.time()]
+
+    async def auto_explore(self):
+        for fleet_id, explore_id in self.finished_explore():
+            await self.explore_result(explore_id)
+            await self.explore(fleet_id, explore_id)
+
+    async def get_all_explore(self):
+        for fleet_id, explore_id in self.finished_explore():
+            await self.explore_result(explore_id)
+
+    async def cancel_explore(self, fleet_id):
+        for ex in self.pveExplore:
+            if int(fleet_id) == int(ex["fleetId"]):
+                r = await self.get(self.api.cancel_explore(ex["exploreId"]))
+                self.pveExplore = r["pveExploreVo"]["levels"]
+                self.fleet = r["fleetVo"]
+                return True
+
+    async def repair_all(self, broken_level=0, instant=False, avoid_working_flag=False):
+        """broken level 0 : 擦伤, 1 : 中破,  2 : 大破
+        不会修理正在远征和修理的船"""
+        ships = self.repair_queue(broken_level, avoid_working_flag)
+        if not instant:
+            for ship_id in self.instant_repair_choice(ships):
+                ships.remove(ship_id)
+                await self.repair(ship_id, 0, instant=True)
+        for dock_index, dock in enumerate(self.repairDock):
+            if "endTime" in dock:
+                if dock["endTime"] + self.common_lag < time.time():
+                    await self.repair_complete(dock["shipId"], dock_index)
+            if "endTime" not in dock and dock["locked"] == 0 and len(ships) > 0:
+                await self.repair(ships.pop(), dock_index, instant)
+
+    async def repair(self, ship_id, dock_id, instant=False):
+        ship = self.userShip[ship_id]
+        await asyncio.sleep(1)
+        if not instant and ship.status == 0:
+            r = await self.get(self.api.repair(ship_id, dock_id + 1))
+            zlogger.debug("repair {}".format(self.userShip[ship_id].name))
+            self.repairDock = r["repairDockVo"]
+            self.userShip.update(r["shipVO"])
+        elif ship.status in [0, 2]:
+            r = await self.get(self.api.instantRepairShips([ship_id]))
+            zlogger.debug("instant repair {}".format(self.userShip[ship_id].name))
+            self.userShip.update(r["shipVOs"])
+            if "repairDockVo" in r:
+                self.repairDock = r["repairDockVo"]
+
+    async def repair_complete(self, ship_id, dock_id):
+        r = await self.get(self.api.repairComplete(ship_id, dock_id + 1))
+        self.repairDock = r["repairDockVo"]
+        if "shipVO" in r:
+            self.userShip.update(r["shipVO"])
+
+    async def change_ships(self):
+        ship_groups = [i for i in self.ship_groups if i[0] != None]
+        for i, g in enumerate(ship_groups):
+            if not g[0]:
+                zlogger.info("no ship to use in location {}".format(i))
+                return False
+
+        candidates = [self.fleet_candidates(g) for g in ship_groups]
+        fleet = self.assign_fleet(candidates)
+        if fleet is None:
+            instant_candidates = [self.instant_candidates(g) if g[2] else [] for g in ship_groups]
+            fleet = self.assign_fleet([c + i_c for c, i_c in zip(candidates, instant_candidates)])
+            if fleet is None:
+                zlogger.debug("no ship to use for ship groups")
+                return False
+            # 只快修从本位置快修候选里选出的船, 别的位置的快修候选在这里可能只是轻伤
+            for pick, normal in zip(fleet, candidates):
+                if pick not in normal:
+                    await self.repair(pick[0], 0, instant=True)
+
+        tmp_fleet_ships_id = [ship_id for ship_id, _ in fleet]
+        if tmp_fleet_ships_id != self.working_ships_id:
+            await self.instant_workingfleet(tmp_fleet_ships_id)
+        return True
+
+    async def instant_workingfleet(self, ships_id):
+        if ships_id:
+            return await self.instant_fleet(self.working_fleet, ships_id)
+
+    async def instant_fleet(self, fleet_id, ships_id):
+        fleet_id = int(fleet_id)
+        if ships_id:
+            for new_id in ships_id:
+                current_fid = self.userShip[new_id].fleet_id
+                if current_fid not in [fleet_id, 0]:
+                    await self.instant_fleet(current_fid, [s for s in self.fleet_ships_id(current_fid) if s != new_id])
+
+            zlogger.debug('编队{}: {}'.format(fleet_id, [self.userShip[i].name for i in ships_id]))
+            r = await self.get(self.api.instantFleet(fleet_id, ships_id))
+            if len(r["fleetVo"]) == 1:
+                f = r["fleetVo"][0]
+            else:
+                f = r["fleetVo"][fleet_id - 1]
+            self.fleet[fleet_id - 1] = f
+            self.update_fleet_index()
+            self.userShip.update(r['shipVO'])
+            return r
+
+    async def supply_workingfleet(self):
+        return await self.supplyFleet(self.working_fleet)
+
+    async def supplyFleet(self, fleet_id):
+        if any([s["battlePropsMax"]["oil"] - s["battleProps"]["oil"] for s in self.fleet_ships(fleet_id)]):
+            r = await self.get(self.url_server + "/boat/supplyFleet/{}/".format(fleet_id))
+            self.userShip.update(r['shipVO'])
+            return r
+
+    async def supply_boats(self, ships_id):
+        ships = [self.userShip[i] for i in ships_id]
+        if any([s["battlePropsMax"]["oil"] - s["battleProps"]["oil"] for s in ships]):
+            r = await self.get(self.api.supplyBoats(ships_id))
+            self.userShip.update(r['shipVO'])
+
+
+async def run_accounts(emulators, job):
+    """run the coroutine function job(emulator) for every emulator on the current loop
+
+    a failing account does not stop the others, its exception is returned in place of the result"""
+    return await asyncio.gather(*[job(e) for e in emulators], return_exceptions=True)
@@ -1,11 +1,23 @@
 """
 This example shows how one can add a custom contentview to mitmproxy.
 The content view API is explained in the mitmproxy.contentviews module.
+
+Every game response is also archived as replay fixtures, see ZjsnArchive.
+The archive directory can be served by zreplay.ReplayServer.
 """
 from mitmproxy import contentviews
+import datetime
+import gzip
+import os
+import shutil
+import threading
+import time
 import zlib
 import json
 
+import zmetrics
+import zreplay
+
 
 class ViewZjsn(contentviews.View):
     name = "zjsn"
@@ -19,12 +31,129 @@ class ViewZjsn(contentviews.View):
         return "zjsn json body", contentviews.format_text(json.dumps(jp, sort_keys=True, indent=4, ensure_ascii=False))
 
 
+class ZjsnArchive(object):
+    """rotating archive of game responses in the session format of zreplay
+
+    the active file is plain json lines and is gzip compressed when it is rotated after max_records responses.
+    index.json maps endpoint paths to [file, line] of every response, it is replaced atomically
+    at most every index_interval seconds and on rotation. nothing is written before the first response"""
+    game_hosts = ('moefantasy.com', 'warshipgirls.com')
+
+    def __init__(self, directory, max_records=5000, index_interval=1.0):
+        super(ZjsnArchive, self).__init__()
+        self.directory = directory
+        self.max_records = max_records
+        self.index_interval = index_interval
+        self.index = None
+        self._file = None
+        self._file_name = None
+        self._records = 0
+        self._index_saved = 0.0
+        self._lock = threading.Lock()
+
+    def is_game_flow(self, flow):
+        return flow.response is not None and flow.request.pretty_host.endswith(self.game_hosts)
+
+    @staticmethod
+    def decode(content, content_type):
+        try:
+            if content_type.split(';')[0].strip() == 'application/octet-stream':
+                content = zlib.decompress(content)
+            return json.loads(content.decode('utf8'))
+        except (ValueError, zlib.error):
+            return None
+
+    def open(self):
+        """create the directory, load index.json and compress the active file a killed capture left behind"""
+        os.makedirs(self.directory, exist_ok=True)
+        self.index = {}
+        index_path = os.path.join(self.directory, 'index.json')
+        if os.path.exists(index_path):
+            with open(index_path, encoding='utf-8') as f:
+                self.index = json.load(f)
+        for name in sorted(os.listdir(self.directory)):
+            if name.endswith('.jsonl'):
+                path = os.path.join(self.directory, name)
+                with open(path, 'rb+') as f:
+                    f.truncate(f.read().rfind(b'\n') + 1)  # 去掉被打断的半行
+                # index.json可能比文件落后, 按文件内容重建这一段的索引
+                for entries in self.index.values():
+                    entries[:] = [e for e in entries if e[0] != name]
+                records = zreplay.load_session(path)
+                for line, record in enumerate(records):
+                    self.index.setdefault(zmetrics.endpoint_template(record['url']), []).append([name, line])
+                self.compress(name)
+        self.save_index()
+
+    def compress(self, name):
+        """gzip the finished file name and point its index entries to the compressed file"""
+        path = os.path.join(self.directory, name)
+        with open(path, 'rb') as src, gzip.open(path + '.gz.tmp', 'wb') as dst:
+            shutil.copyfileobj(src, dst)
+        os.replace(path + '.gz.tmp', path + '.gz')
+        os.remove(path)
+        for entries in self.index.values():
+            for entry in entries:
+                if entry[0] == name:
+                    entry[0] = name + '.gz'
+
+    def rotate(self):
+        if self.index is None:
+            self.open()
+        if self._file:
+            self._file.close()
+            self.compress(self._file_name)
+        self._file_name = '{:%Y%m%d-%H%M%S-%f}.jsonl'.format(datetime.datetime.now())
+        self._file = zreplay.open_session(os.path.join(self.directory, self._file_name), 'at')
+        self._records = 0
+        self.save_index()
+
+    def add(self, flow):
+        request, response = flow.request, flow.response
+        body = self.decode(response.content, response.headers.get('Content-Type', ''))
+        cookies = {name: value for name, (value, attrs) in response.cookies.items(multi=True)}
+        elapsed = (response.timestamp_end or request.timestamp_start) - request.timestamp_start
+        record = zreplay.make_record(request.method, request.pretty_url, response.status_code, body, cookies, elapsed)
+        with self._lock:
+            if self._file is None or self._records >= self.max_records:
+                self.rotate()
+            self._file.write(json.dumps(record, ensure_ascii=False, separators=(',', ':')) + '\n')
+            self._file.flush()
+            self.index.setdefault(zmetrics.endpoint_template(request.pretty_url), []).append([self._file_name, self._records])
+            self._records += 1
+            if time.monotonic() - self._index_saved >= self.index_interval:
+                self.save_index()
+
+    def save_index(self):
+        index_path = os.path.join(self.directory, 'index.json')
+        with open(index_path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(self.index, f, ensure_ascii=False)
+        os.replace(index_path + '.tmp', index_path)
+        self._index_saved = time.monotonic()
+
+    def close(self):
+        with self._lock:
+            if self._file:
+                self._file.close()
+                self._file = None
+                self.compress(self._file_name)
+            if self.index is not None:
+                self.save_index()
+
+
 view = ViewZjsn()
+archive = ZjsnArchive(os.environ.get('ZJSN_ARCHIVE', 'zjsn_archive'))
 
 
 def load(l):
     contentviews.add(view)
 
 
+def response(flow):
+    if archive.is_game_flow(flow):
+        archive.add(flow)
+
+
 def done():
-    contentviews.remove(view)
\ No newline at end of file
+    contentviews.remove(view)
+    archive.close()
\ No newline at end of file
@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+import bisect
+import collections
+import functools
+import threading
+import urllib.parse
+from typing import Dict
+
+# 已知接口的路径前缀 -> 后面各段参数的名字
+ENDPOINT_PARAMS = {
+    '/index/checkVer': ('version', 'channel', 'market'),
+    '/index/login': ('uid',),
+    '/pve/cha11enge': ('map', 'fleet', 'flag'),
+    '/pve/deal': ('node', 'fleet', 'formation'),
+    '/pve/dealto': ('node', 'fleet', 'formation'),
+    '/pve/getWarResult': ('night',),
+    '/pvp/spy': ('uid', 'fleet'),
+    '/pvp/challenge': ('uid', 'fleet', 'formation'),
+    '/pvp/getWarResult': ('night',),
+    '/friend/spy': ('uid', 'fleet'),
+    '/friend/challenge': ('uid', 'fleet', 'formation'),
+    '/friend/getWarResult': ('night',),
+    '/friend/kiss': ('ship',),
+    '/campaign/getFleet': ('mission',),
+    '/campaign/changeFleet': ('mission', 'ship', 'position'),
+    '/campaign/spy': ('mission',),
+    '/campaign/challenge': ('mission', 'formation'),
+    '/campaign/getWarResult': ('night',),
+    '/boat/instantFleet': ('fleet', 'ships'),
+    '/boat/instantRepairShips': ('ships',),
+    '/boat/lock': ('ship',),
+    '/boat/repair': ('ship', 'dock'),
+    '/boat/repairComplete': ('dock', 'ship'),
+    '/boat/strengthen': ('ship', 'ships'),
+    '/boat/renameShip': ('ship', 'name'),
+    '/boat/skillLevelUp': ('ship',),
+    '/boat/supplyBoats': ('ships',),
+    '/boat/supplyFleet': ('fleet',),
+    '/dock/dismantleBoat': ('ships', 'keep_equipment'),
+    '/dock/buildBoat': ('dock', 'oil', 'ammo', 'steel', 'aluminum'),
+    '/dock/buildEquipment': ('dock', 'oil', 'ammo', 'steel', 'aluminum'),
+    '/dock/getBoat': ('dock',),
+    '/dock/getEquipment': ('dock',),
+    '/dock/instantBuild': ('dock',),
+    '/explore/start': ('fleet', 'explore'),
+    '/explore/getResult': ('explore',),
+    '/explore/cancel': ('explore',),
+    '/task/getAward': ('task',),
+}
+
+
+def _is_param(segment):
+    return segment.lstrip('-').isdigit() or segment.startswith('[')
+
+
+@functools.lru_cache(maxsize=4096)
+def endpoint_template(url):
+    """endpoint of url with its parameters named, /pve/dealto/5/1/2 is /pve/dealto/{node}/{fleet}/{formation}
+
+    unknown endpoints get {} for their number and list segments"""
+    segments = urllib.parse.urlsplit(url).path.rstrip('/').split('/')
+    for k in range(len(segments), 1, -1):
+        names = ENDPOINT_PARAMS.get('/'.join(segments[:k]))
+        if names is not None:
+            params = ['{{{}}}'.format(names[i]) if i < len(names) else '{}' for i in range(len(segments) - k)]
+            return '/'.join(segments[:k] + params)
+    return '/'.join('{}' if _is_param(seg) else seg for seg in segments) or '/'
+
+
+class EndpointStats(object):
+    """counters of one endpoint template"""
+
+    def __init__(self, buckets):
+        super(EndpointStats, self).__init__()
+        self.requests = 0
+        self.retries = 0
+        self.bytes = 0
+        self.latency_sum = 0.0
+        self.latency_buckets = [0] * (len(buckets) + 1)  # 最后一个是+Inf
+        self.status = collections.Counter()
+        self.eid = collections.Counter()
+        self.transport_errors = 0
+
+    def as_dict(self, buckets):
+        return {'requests': self.requests,
+                'retries': self.retries,
+                'bytes': self.bytes,
+                'latency_sum': self.latency_sum,
+                'latency_avg': self.latency_sum / self.requests if self.requests else 0.0,
+                'latency_histogram': collections.OrderedDict(zip(list(buckets) + ['+Inf'], self.latency_buckets)),
+                'status': dict(self.status),
+                'eid': dict(self.eid),
+                'transport_errors': self.transport_errors}
+
+
+class ZjsnMetrics(object):
+    """latency, retries, eid and bytes per endpoint template, one instance can be shared by several emulators"""
+
+    buckets = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+    def __init__(self):
+        super(ZjsnMetrics, self).__init__()
+        self.endpoints = {}  # type: Dict[str, EndpointStats]
+        self._lock = threading.Lock()
+
+    def _stats(self, url):
+        template = endpoint_template(url)
+        stats = self.endpoints.get(template)
+        if stats is None:
+            stats = self.endpoints[template] = EndpointStats(self.buckets)
+        return stats
+
+    def observe(self, url, seconds, size, status):
+        """one finished http exchange"""
+        with self._lock:
+            stats = self._stats(url)
+            stats.requests += 1
+            stats.bytes += size
+            stats.latency_sum += seconds
+            stats.latency_buckets[bisect.bisect_left(self.buckets, seconds)] += 1
+            stats.status[status] += 1
+
+    def retry(self, url):
+        with self._lock:
+            self._stats(url).retries += 1
+
+    def transport_error(self, url):
+        with self._lock:
+            self._stats(url).transport_errors += 1
+
+    def error(self, url, eid):
+        with self._lock:
+            self._stats(url).eid[eid] += 1
+
+    @property
+    def total_requests(self):
+        return sum(stats.requests for stats in self.endpoints.values())
+
+    def snapshot(self, template=None):
+        """{template: counters} of every endpoint, or the counters of one template"""
+        with self._lock:
+            if template is not None:
+                stats = self.endpoints.get(template)
+                return stats.as_dict(self.buckets) if stats else None
+            return {t: stats.as_dict(self.buckets) for t, stats in self.endpoints.items()}
+
+    def slowest(self, n=10):
+        """(template, average seconds) of the n slowest endpoints"""
+        snapshot = self.snapshot()
+        return sorted(((t, s['latency_avg']) for t, s in snapshot.items()), key=lambda x: x[1], reverse=True)[:n]
+
+    def reset(self):
+        with self._lock:
+            self.endpoints = {}
+
+    def prometheus(self, prefix='zjsn'):
+        """metrics in the prometheus text exposition format"""
+        lines = []
+
+        def family(name, kind, doc):
+            lines.append('# HELP {}_{} {}'.format(prefix, name, doc))
+            lines.append('# TYPE {}_{} {}'.format(prefix, name, kind))
+
+        def sample(name, labels, value):
+            label_text = ','.join('{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+                                  for k, v in labels)
+            lines.append('{}_{}{{{}}} {}'.format(prefix, name, label_text, value))
+
+        with self._lock:
+            endpoints = sorted(self.endpoints.items())
+            family('request_duration_seconds', 'histogram', 'latency of game requests')
+            for t, stats in endpoints:
+                cumulative = 0
+                for le, count in zip(list(self.buckets) + ['+Inf'], stats.latency_buckets):
+                    cumulative += count
+                    sample('request_duration_seconds_bucket', [('endpoint', t), ('le', le)], cumulative)
+                sample('request_duration_seconds_sum', [('endpoint', t)], stats.latency_sum)
+                sample('request_duration_seconds_count', [('endpoint', t)], stats.requests)
+            family('requests_total', 'counter', 'game requests by http status')
+            for t, stats in endpoints:
+                for status, count in sorted(stats.status.items()):
+                    sample('requests_total', [('endpoint', t), ('status', status)], count)
+            family('retries_total', 'counter', 'retried game requests')
+            for t, stats in endpoints:
+                sample('retries_total', [('endpoint', t)], stats.retries)
+            family('transport_errors_total', 'counter', 'connection errors and timeouts')
+            for t, stats in endpoints:
+                sample('transport_errors_total', [('endpoint', t)], stats.transport_errors)
+            family('eid_total', 'counter', 'game error codes')
+            for t, stats in endpoints:
+                for eid, count in sorted(stats.eid.items()):
+                    sample('eid_total', [('endpoint', t), ('eid', eid)], count)
+            family('response_bytes_total', 'counter', 'response body bytes after decompression')
+            for t, stats in endpoints:
+                sample('response_bytes_total', [('endpoint', t)], stats.bytes)
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+"""record the requests of ZjsnEmulator and serve them again from a local stand-in of the game servers
+
+record:
+    ze.transport = zreplay.RecordingTransport('session.jsonl.gz')
+replay:
+    server = zreplay.ReplayServer('session.jsonl.gz', latency=0.05).start()
+    ze.s.proxies.update(server.proxies)
+
+a session file is json lines, one request per line, gzip compressed when the name ends with .gz"""
+import argparse
+import collections
+import gzip
+import http.server
+import json
+import logging
+import os
+import threading
+import time
+import urllib.parse
+
+import zmetrics
+import ztransport
+
+zlogger = logging.getLogger('zjsn.zrobot.zreplay')
+
+SESSION_FORMAT = 1
+
+
+def open_session(path, mode='rt'):
+    if path.endswith('.gz'):
+        return gzip.open(path, mode, encoding='utf-8')
+    return open(path, mode, encoding='utf-8')
+
+
+def load_session(path):
+    """records of a session file, in request order, a directory is read as a rotated archive
+
+    a file which is still being written or whose recorder was killed is read up to its last complete line"""
+    if os.path.isdir(path):
+        names = set(os.listdir(path))
+        records = []
+        for name in sorted(names):
+            # 压缩到一半被打断时两个文件都在, 以压缩好的为准
+            if name.endswith('.jsonl.gz') or (name.endswith('.jsonl') and name + '.gz' not in names):
+                records.extend(load_session(os.path.join(path, name)))
+        return records
+    lines = []
+    with open_session(path) as f:
+        try:
+            for line in f:
+                if line.strip():
+                    lines.append(line)
+        except EOFError:
+            zlogger.warning('{} has no gzip trailer, read up to the last complete line'.format(path))
+    records = []
+    for i, line in enumerate(lines):
+        try:
+            records.append(json.loads(line))
+        except ValueError:
+            if i != len(lines) - 1:
+                raise
+            zlogger.warning('{} ends with a partial line'.format(path))
+    return records
+
+
+def make_record(method, url, status, body, cookies=None, elapsed=0.0):
+    return {'v': SESSION_FORMAT,
+            'time': time.time(),
+            'method': method,
+            'url': url,
+            'status': status,
+            'body': body,
+            'cookies': cookies or {},
+            'elapsed': elapsed}
+
+
+class RecordingTransport(ztransport.ZjsnTransport):
+    """ZjsnTransport which appends every finished request to a session file
+
+    request bodies are not recorded, so passwords do not end up in the session"""
+
+    def __init__(self, path, **kwargs):
+        super(RecordingTransport, self).__init__(**kwargs)
+        self.path = path
+        self._file = open_session(path, 'at')
+        self._lock = threading.Lock()
+
+    def request(self, method, url, **kwargs):
+        r = super(RecordingTransport, self).request(method, url, **kwargs)
+        try:
+            body = ztransport.loads(r.content)
+        except ValueError:
+            body = None
+        record = make_record(method, url, r.status_code, body, requests_cookies(r), r.elapsed.total_seconds())
+        with self._lock:
+            self._file.write(json.dumps(record, ensure_ascii=False, separators=(',', ':')) + '\n')
+            self._file.flush()
+        return r
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+def requests_cookies(r):
+    return {k: v for k, v in r.cookies.items()}
+
+
+class ReplayServer(object):
+    """http proxy answering every request with the next recorded response of the same url
+
+    responses of one url are served in recorded order, the last one repeats when they run out.
+    urls are matched with their query string first, then by host and path.
+    latency is a number of seconds or 'recorded' to wait as long as the recorded request took"""
+
+    def __init__(self, session, host='127.0.0.1', port=0, latency=0.0):
+        super(ReplayServer, self).__init__()
+        records = load_session(session) if isinstance(session, str) else list(session)
+        self.latency = latency
+        self.misses = []  # 没有录到的请求
+        self.served = 0
+        self._lock = threading.Lock()
+        self._queues = collections.defaultdict(collections.deque)
+        self._path_queues = collections.defaultdict(collections.deque)
+        for record in records:
+            self._queues[self.key(record['method'], record['url'])].append(record)
+            self._path_queues[self.key(record['method'], record['url'], query=False)].append(record)
+        self.httpd = http.server.ThreadingHTTPServer((host, port), self.handler_class())
+        self.httpd.daemon_threads = True
+        self.thread = None
+
+    @staticmethod
+    def key(method, url, query=True):
+        u = urllib.parse.urlsplit(url)
+        return method.upper(), u.netloc, u.path.rstrip('/'), u.query if query else ''
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return 'http://{}:{}'.format(host, port)
+
+    @property
+    def proxies(self):
+        """proxies for a requests session, the game servers only speak http"""
+        return {'http': self.url}
+
+    def next_record(self, method, url):
+        with self._lock:
+            for queues, query in ((self._queues, True), (self._path_queues, False)):
+                queue = queues.get(self.key(method, url, query))
+                if queue:
+                    record = queue.popleft() if len(queue) > 1 else queue[0]
+                    self.served += 1
+                    return record
+            self.misses.append((method, url))
+            return None
+
+    def delay(self, record):
+        if self.latency == 'recorded':
+            return record.get('elapsed', 0)
+        return self.latency
+
+    def handler_class(self):
+        server = self
+
+        class ReplayHandler(http.server.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                zlogger.debug(format % args)
+
+            def replay(self):
+                length = int(self.headers.get('Content-Length', 0))
+                if length:
+                    self.rfile.read(length)
+                url = self.path
+                if not urllib.parse.urlsplit(url).netloc:
+                    # 直接访问而不是走代理时用Host头补全url
+                    url = 'http://{}{}'.format(self.headers.get('Host', ''), url)
+                record = server.next_record(self.command, url)
+                if record is None:
+                    zlogger.warning('no recorded response for {} {}'.format(self.command, url))
+                    status, body, cookies = 404, {'error': 'no recorded response'}, {}
+                else:
+                    time.sleep(server.delay(record))
+                    status, body, cookies = record['status'], record['body'], record['cookies']
+                data = b'' if body is None else json.dumps(body, ensure_ascii=False).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'text/html; charset=UTF-8')
+                self.send_header('Content-Length', str(len(data)))
+                for name, value in cookies.items():
+                    self.send_header('Set-Cookie', '{}={}; path=/'.format(name, value))
+                self.end_headers()
+                self.wfile.write(data)
+
+            do_GET = replay
+            do_POST = replay
+
+        return ReplayHandler
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser("replay a recorded session as a local game server proxy")
+    parser.add_argument("session", help="session file recorded by RecordingTransport, or an archive directory")
+    parser.add_argument("--host", default='127.0.0.1')
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--latency", default='0', help="seconds per request or 'recorded'")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    latency = args.latency if args.latency == 'recorded' else float(args.latency)
+    replay_server = ReplayServer(args.session, args.host, args.port, latency)
+    zlogger.info('replaying {} on {}'.format(args.session, replay_server.url))
+    replay_server.httpd.serve_forever()
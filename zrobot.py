@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 import argparse
 import collections
+import heapq
 import logging
 import os
 import random
@@ -8,7 +9,7 @@ import string
 import threading
 import time
 from datetime import datetime
-from itertools import zip_longest
+from itertools import chain, zip_longest
 from logging import handlers
 from typing import List
 
@@ -221,6 +222,8 @@ class Node(object):
 class Mission(object):
     """docstring for Mission"""
 
+    priority = 0  # 越大越先出击, 相同时按添加顺序
+
     def __init__(self, mission_name, mission_code, ze: zemulator.ZjsnEmulator):
         super().__init__()
         self.enable = False
@@ -254,7 +257,6 @@ class Mission(object):
     @property
     def trigger(self):
         return {'trigger': 'go_out',
-                'prepare': self._prepare,
                 'source': 'init',
                 'dest': self.state.name,
                 'conditions': [self.condition],
@@ -287,13 +289,17 @@ class Mission(object):
             # self.ze.working_fleet = 2
             return True
 
+    def ready(self):
+        """local check before any request, missions that are not ready are skipped by MissionScheduler"""
+        return self.enable and self.get_working_fleet()
+
     def _prepare(self):
-        if not (self.get_working_fleet() and self.enable):
+        if not self.ready():
             self.available = False
             return
         self.available = self.prepare()
-        self.ze.supply_workingfleet()
         if self.available:
+            self.ze.supply_workingfleet()
             try:
                 self.ze.go_out(self.mission_code)
             except zemulator.ZjsnError as e:
@@ -397,19 +403,26 @@ class Explore(Mission):
                     self.ze.supply_fleet(explore_fleet)
                     self.ze.explore(explore_fleet, table[1])
 
-    def check_explore(self):
-        self.ze.get_all_explore()
-        exploring_fleet = [e['fleetId'] for e in self.ze.pveExplore]
-        running_explore = [e['exploreId'] for e in self.ze.pveExplore]
+    def idle_explore(self):
+        """(fleet_id, table) of the explore fleets which can start an explore now"""
+        exploring_fleet = [e['fleetId'] for e in self.ze.pveExplore if 'fleetId' in e]
+        running_explore = [e['exploreId'] for e in self.ze.pveExplore if 'exploreId' in e]
+        idle = []
         for i, table in enumerate(self.explore_table):
             fleet_id = i + 5
             if str(fleet_id) not in exploring_fleet and 0 not in table[0] and table[1] not in running_explore:
-                if self.ze.fleet_ships_id(fleet_id) != table[0]:
-                    self.ze.instant_fleet(fleet_id, table[0])
-                self.ze.supplyFleet(fleet_id)
-                self.ze.explore(fleet_id, table[1])
-                _logger.debug(
-                    "fleet {} start explore {}".format(fleet_id, table[1]))
+                idle.append((fleet_id, table))
+        return idle
+
+    def check_explore(self):
+        self.ze.get_all_explore()
+        for fleet_id, table in self.idle_explore():
+            if self.ze.fleet_ships_id(fleet_id) != table[0]:
+                self.ze.instant_fleet(fleet_id, table[0])
+            self.ze.supplyFleet(fleet_id)
+            self.ze.explore(fleet_id, table[1])
+            _logger.debug(
+                "fleet {} start explore {}".format(fleet_id, table[1]))
 
     def start(self):
         pass
@@ -420,6 +433,7 @@ class Explore(Mission):
         self.ze.repair_all(0)
         self.ze.get_award()
         self.ze.auto_build()
+        self.ze.dismantle()
         self.ze.auto_build_equipment()
         if explore_over_fleet:
             self.ze.working_fleet = explore_over_fleet
@@ -464,8 +478,11 @@ class Campaign(Mission):
     def set_first_nodes(self):
         pass
 
+    def ready(self):
+        return self.ze.campaign_num > 0
+
     def _prepare(self):
-        pass
+        self.available = bool(self.ready() and self.prepare())
 
     def start(self):
 
@@ -522,6 +539,9 @@ class HolyBuild(Mission):
     def set_first_nodes(self):
         pass
 
+    def ready(self):
+        return bool(self.plan)
+
     def _prepare(self):
         for target in self.plan:
             card = zemulator._INIT_DATA_.get_card_by_name(target)
@@ -539,6 +559,8 @@ class HolyBuild(Mission):
 class Challenge(Mission):
     """docstring for Challenge"""
 
+    minimal_sl_refresh = True  # SL时只放弃战斗, 不刷新战役, 胖次和任务
+
     def __init__(self, ze: zemulator.ZjsnEmulator):
         super(Challenge, self).__init__('challenge', 0, ze)
         self.ze = ze
@@ -572,27 +594,25 @@ class Challenge(Mission):
         # sorted(self.ze.userShip, key=lambda x: x["level"], reverse=True)
         return [s.id for s in ships if s.type in ['战列', '战巡', '航母']]
 
+    def ready(self):
+        if not self.get_working_fleet():
+            return False
+        check_points = [self.ze.now.replace(hour=0, minute=0), self.ze.now.replace(
+            hour=12), self.ze.now.replace(hour=18, minute=0)]
+        return any(self.last_challenge_time < p < self.ze.now for p in check_points)
+
     def _prepare(self):
+        self.challenge_list = {}
+        self.friend_available = False
+        if not self.ready():
+            self.available = False
+            return
+
         if not self.ship_list:
             ship_list = self.generate_challenge_ships()
         else:
             ship_list = self.ship_list
         self.init_friends()
-        if not self.get_working_fleet():
-            self.available = False
-            return
-
-        self.challenge_list = {}
-        self.friend_available = False
-
-        check_points = [self.ze.now.replace(hour=0, minute=0), self.ze.now.replace(
-            hour=12), self.ze.now.replace(hour=18, minute=0)]
-        for p in check_points:
-            if self.last_challenge_time < p < self.ze.now:
-                self.available = True
-
-        if not self.available:
-            return
 
         self.ze.go_home()
         self.old_fleet = self.ze.working_ships_id.copy()
@@ -695,6 +715,7 @@ class Challenge(Mission):
         else:
             api = 'pvp'
         night_flag = 1
+        requests_before = self.ze.metrics.total_requests
 
         n = self.start_point
         _logger.debug(enemy_uid)
@@ -732,7 +753,7 @@ class Challenge(Mission):
         over = False
         while not over:
             _logger.debug("SL {} 次".format(n))
-            self.ze.go_home()
+            self.ze.go_home(minimal=self.minimal_sl_refresh)
             r1 = self.ze.get(
                 self.ze.url_server + "/{}/spy/{}/{}".format(api, enemy_uid, self.ze.working_fleet))
             r2 = self.ze.get(
@@ -772,34 +793,130 @@ class Challenge(Mission):
             self.ze.result_list[int(r3["warResult"]["resultLevel"])]))
         _logger.debug("challenge fleet:{}".format(
             [(si.name, si.level) for si in self.ze.working_ships]))
+        _logger.debug("challenge {} finished, SL {} 次, {} requests".format(
+            enemy_uid, n - self.start_point, self.ze.metrics.total_requests - requests_before))
+
+
+class MissionScheduler(object):
+    """pick the mission of this go_out before the transitions are tried
+
+    missions are ranked by priority, missions whose local ready check fails cost no request.
+    only the first ready mission whose prepare succeeds is available, so the transitions
+    machine only has to read the conditions. prepare starts the battle, so plan only while
+    the robot is in the init state"""
+
+    def __init__(self):
+        super(MissionScheduler, self).__init__()
+        self.missions = []  # type: List[Mission]
+        self.current = None
+
+    def add(self, mission: Mission):
+        self.missions.append(mission)
+
+    def ranked(self):
+        return sorted(self.missions, key=lambda m: -m.priority)
+
+    def plan(self):
+        self.current = None
+        for mission in self.missions:
+            mission.available = False
+        for mission in self.ranked():
+            if not mission.ready():
+                continue
+            mission._prepare()
+            if mission.available:
+                self.current = mission
+                break
+        return self.current
+
+
+class CompletionTimer(object):
+    """heap of the end times of explores, repairs and builds
+
+    the heap is rebuilt only when the emulator replaces one of its dock lists"""
+
+    def __init__(self, ze: zemulator.ZjsnEmulator):
+        super(CompletionTimer, self).__init__()
+        self.ze = ze
+        self._heap = []
+        self._revision = None
+
+    def refresh(self):
+        if self._revision != self.ze.dock_revision:
+            self._heap = self.ze.completion_times()
+            heapq.heapify(self._heap)
+            self._revision = self.ze.dock_revision
+
+    def next_time(self, now=None):
+        """time of the next completion after now, None if nothing is running"""
+        self.refresh()
+        if now is None:
+            now = time.time()
+        if self._heap and self._heap[0][0] > now:
+            return self._heap[0][0]
+        # 已经到期但没收取的(比如船坞满了)不算
+        return min((end_time for end_time, kind in self._heap if end_time > now), default=None)
+
+    def due(self, now=None):
+        """kinds of work finished by now"""
+        self.refresh()
+        if now is None:
+            now = time.time()
+        return {kind for end_time, kind in self._heap if end_time < now}
 
 
 class Dock(State):
+    max_wait = 10  # wait最多睡的秒数
+
     def __init__(self, ze: zemulator.ZjsnEmulator):
         super().__init__(name='init', on_enter=self.go_home)
         self.ze = ze
         self.explore_mod = Explore(self.ze)
+        self.timer = CompletionTimer(self.ze)
 
     def go_home(self):
         self.ze.go_home()
         self.ze.repair_all(0, avoid_working_flag=True)
         self.check()
 
+    @staticmethod
+    def has_free_slot(docks):
+        return any('endTime' not in d and d.get('locked') == 0 for d in docks)
+
     def check(self):
+        """only touch the docks with finished work or something to start"""
+        due = self.timer.due()
         # todo change auto_explore to more strict method
         if self.ze.version < self.ze.KEY_VERSION:
             self.ze.auto_explore()
             self.ze.supply_workingfleet()
         self.ze.relogin()
         self.ze.get_award()
-        self.ze.auto_build()
-        self.ze.auto_build_equipment()
-        self.explore_mod.check_explore()
+        if 'build' in due or (self.ze.build_boat_remain > 0 and self.has_free_slot(self.ze.dock)):
+            self.ze.auto_build()
+        # 出击掉落也会占船位, 不管有没有建造都要拆船, 否则船坞满了就出不了击
+        self.ze.dismantle()
+        if 'build_equipment' in due or \
+                (self.ze.build_equipment_remain > 0 and self.has_free_slot(self.ze.equipmentDock)):
+            self.ze.auto_build_equipment()
+        if 'explore' in due or self.explore_mod.idle_explore():
+            self.explore_mod.check_explore()
+
+    def repair(self, broken_level=0):
+        if 'repair' in self.timer.due() or \
+                (self.has_free_slot(self.ze.repairDock) and self.ze.repair_queue(broken_level)):
+            self.ze.repair_all(broken_level)
 
     def wait(self):
         self.check()
-        self.ze.repair_all(0)
-        time.sleep(10)
+        self.repair(0)
+        # 睡到下一个远征, 修理或建造完成, 最多睡max_wait秒
+        now = time.time()
+        next_time = self.timer.next_time(now)
+        if next_time is None:
+            time.sleep(self.max_wait)
+        else:
+            time.sleep(min(self.max_wait, next_time - now))
 
 
 class Mission_1_1(Mission):
@@ -813,7 +930,7 @@ class Mission_1_1(Mission):
     def prepare(self):
         # 所有高级改造DD
         dd_ships = []
-        for ship in sorted(self.ze.userShip, key=lambda x: x["level"], reverse=True):
+        for ship in self.ze.userShip.of_type(['驱逐'], reverse=True):
             conditions = [ship["level"] > 20,
                           ship.type in ['驱逐'],
                           ]
@@ -908,9 +1025,11 @@ class TacticTrain_Campaign(Mission):
     def set_first_nodes(self):
         pass
 
+    def ready(self):
+        return self.enable and self.ze.campaign_num > 0
+
     def _prepare(self):
-        if self.enable:
-            self.available = self.prepare()
+        self.available = bool(self.ready() and self.prepare())
 
     def start(self):
 
@@ -947,7 +1066,7 @@ class Mission_1_5(Mission_1_1):
     def prepare(self):
         # 所有高级改造DD
         dd_ships = []
-        for ship in sorted(self.ze.userShip, key=lambda x: x["level"], reverse=True):
+        for ship in self.ze.userShip.of_type(['驱逐'], reverse=True):
             conditions = [self.ze.max_level > ship["level"] > 20,
                           ship.type in ['驱逐'],
                           ]
@@ -992,7 +1111,7 @@ class Mission_2_1(Mission):
     def prepare(self):
         # 所有高级改造DD
         dd_ships = []
-        for ship in sorted(self.ze.userShip, key=lambda x: x["level"], reverse=False):
+        for ship in self.ze.userShip.of_type(['驱逐'], reverse=False):
             conditions = [ship["level"] > 80,
                           ship.type in ['驱逐'],
                           ship.evolved == 1,
@@ -1004,7 +1123,7 @@ class Mission_2_1(Mission):
 
         # 所有高级改造CV
         cv_ships = []
-        for ship in sorted(self.ze.userShip, key=lambda x: x["level"], reverse=False):
+        for ship in self.ze.userShip.of_type(['航母', '装母'], reverse=False):
             conditions = [ship["level"] > 80,
                           ship.type in ['航母', '装母'],
                           ]
@@ -1053,12 +1172,12 @@ class Mission_6_1_A(Mission):
         )
         return [s.id for s in boss_ships]
 
-    def prepare(self):
+    def ready(self):
         if self.last_success and datetime.today().date() > self.last_success:
             self.success_count_today = 0
-        if self.success_count_today > self.max_num_1_day:
-            return False
+        return self.success_count_today <= self.max_num_1_day and super().ready()
 
+    def prepare(self):
         # 所有装了声呐的反潜船
         dd_ships = []
         slow_ships = []
@@ -1174,8 +1293,12 @@ class DailyTask(Mission):
         }
         self.task_mission = None
 
+    def ready(self):
+        return self.enable and any(t in self.ze.task for t in
+                                   chain((5200432, 5200332), self.task_solution, self.type_task))
+
     def _prepare(self):
-        if not self.enable:
+        if not self.ready():
             self.available = False
             return
         # first check build tasks
@@ -1246,6 +1369,7 @@ class Robot(object):
 
         self.machine = Machine(model=self, states=states,
                                initial='init', auto_transitions=False)
+        self.scheduler = MissionScheduler()
         self.command = 'run'
 
         self.add_mission(DailyTask(self.ze))
@@ -1267,7 +1391,8 @@ class Robot(object):
                                         conditions=[self.explore.get_explore])
         else:
             self.machine.add_transition(trigger='go_out', source="init", dest="init",
-                                        conditions=[self.campaign.prepare], after=[self.campaign.start])
+                                        conditions=[self.campaign.condition], after=[self.campaign.start])
+            self.scheduler.add(self.campaign)
 
             self.add_mission(self.build_mission)
             self.set_missions()
@@ -1283,6 +1408,7 @@ class Robot(object):
             raise ValueError(
                 "mission name {} is already used".format(mission.mission_name))
         self.machine.add_states(mission.state)
+        self.scheduler.add(mission)
         self.machine.add_transition(**mission.trigger)
         self.machine.add_transition(**mission.back_trigger)
 
@@ -1318,6 +1444,9 @@ class Robot(object):
         while self.command != 'stop':
             try:
                 if not self.is_sleep():
+                    # 任务的准备会直接出击, 只有在init状态下任务的go_out才能接着打完
+                    if self.state == 'init':
+                        self.scheduler.plan()
                     self.go_out()
                     time.sleep(2)
                 else:
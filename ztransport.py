@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+import json
+import logging
+import random
+import threading
+import time
+import urllib.parse
+import zlib
+
+import requests
+import requests.adapters
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+zlogger = logging.getLogger('zjsn.zrobot.ztransport')
+
+
+def loads(content: bytes):
+    """decode a json response body, with orjson when it is installed"""
+    if orjson is not None:
+        try:
+            return orjson.loads(content)
+        except orjson.JSONDecodeError:
+            # orjson不接受NaN和Infinity, 交给标准库再试一次
+            pass
+    return json.loads(content.decode('utf-8'))
+
+
+def is_compressed(content_type):
+    """the game sends zlib compressed json as application/octet-stream"""
+    return content_type.split(';')[0].strip() == 'application/octet-stream'
+
+
+class ZjsnTransport(object):
+    """http transport of ZjsnEmulator, keeps a pool of keep-alive connections per host
+
+    with compressed=True the server may send zlib compressed bodies, they are inflated while being read"""
+
+    def __init__(self, pool_connections=4, pool_maxsize=8, connect_timeout=5, read_timeout=30,
+                 max_retries=10, backoff_base=1, backoff_cap=300, compressed=False, chunk_size=16384):
+        super(ZjsnTransport, self).__init__()
+        self.pool_connections = pool_connections  # 缓存连接池的host数量
+        self.pool_maxsize = pool_maxsize  # 每个host保持的连接数
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.compressed = compressed
+        self.chunk_size = chunk_size
+        self.session = self.new_session()
+
+    def new_session(self):
+        s = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=self.pool_connections,
+                                                pool_maxsize=self.pool_maxsize)
+        s.mount('http://', adapter)
+        s.mount('https://', adapter)
+        return s
+
+    @property
+    def timeout(self):
+        return self.connect_timeout, self.read_timeout
+
+    def reset_cookies(self):
+        """forget cookies of the last login, pooled connections stay alive"""
+        self.session.cookies.clear()
+
+    def request_headers(self, headers):
+        if self.compressed and headers:
+            # 去掉identity, 服务器才会发压缩的数据
+            headers = {k: v for k, v in headers.items() if k != 'Accept-Encoding'}
+        return headers
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        if not self.compressed:
+            return self.session.request(method, url, **kwargs)
+        kwargs['headers'] = self.request_headers(kwargs.get('headers'))
+        r = self.session.request(method, url, stream=True, **kwargs)
+        if is_compressed(r.headers.get('Content-Type', '')):
+            d = zlib.decompressobj()
+            try:
+                body = [d.decompress(chunk) for chunk in r.iter_content(self.chunk_size)]
+                body.append(d.flush())
+            except zlib.error as e:
+                raise requests.exceptions.ContentDecodingError(e, response=r)
+            r._content = b''.join(body)
+        else:
+            r.content  # 读完body, 连接回到连接池
+        return r
+
+    def backoff(self, error_count):
+        """seconds to wait before the retry after error_count errors, exponential with full jitter"""
+        return random.uniform(0, min(self.backoff_cap, self.backoff_base * 2 ** error_count))
+
+
+class TokenBucket(object):
+    """token bucket whose rate adapts to the server, additive increase and multiplicative decrease
+
+    rate is tokens per second, None means no limit"""
+
+    def __init__(self, rate=None, burst=1, min_rate_ratio=0.125, increase_ratio=0.1, slow_down_interval=1):
+        super(TokenBucket, self).__init__()
+        self.burst = burst
+        self.min_rate_ratio = min_rate_ratio  # 降速的下限是base_rate的比例
+        self.increase_ratio = increase_ratio  # 每次成功恢复base_rate的比例
+        self.slow_down_interval = slow_down_interval  # 同一批请求的多次操作太快只降一次速
+        self.slowed = float('-inf')
+        self.base_rate = rate
+        self.rate = rate
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def set_base_rate(self, rate):
+        with self._lock:
+            self.base_rate = rate
+            self.rate = rate
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self):
+        """take a token, returns the seconds to wait before using it"""
+        if self.rate is None:
+            return 0
+        with self._lock:
+            self._refill(time.monotonic())
+            self.tokens -= 1
+            if self.tokens >= 0:
+                return 0
+            return -self.tokens / self.rate
+
+    def slow_down(self):
+        if self.rate is None:
+            return
+        with self._lock:
+            now = time.monotonic()
+            if now - self.slowed < self.slow_down_interval:
+                return
+            self.slowed = now
+            self._refill(now)
+            self.rate = max(self.base_rate * self.min_rate_ratio, self.rate / 2)
+
+    def speed_up(self):
+        if self.rate is None or self.rate >= self.base_rate:
+            return
+        with self._lock:
+            self._refill(time.monotonic())
+            self.rate = min(self.base_rate, self.rate + self.base_rate * self.increase_ratio)
+
+
+class RateLimiter(object):
+    """request limiter of one account, a bucket for the account and a bucket per host shared by all accounts
+
+    the host buckets cap the total rate of all accounts on a server, 操作太快 only slows down the account
+    which got it, so one hasty account does not stall the others.
+    reserve() returns the seconds to wait, so blocking and asyncio callers can both use it.
+    a replacement limiter of an emulator needs reserve, too_fast, success and set_account_rate"""
+
+    host_rate = 10  # 同一个服务器上所有账号每秒的请求数
+    host_burst = 5
+    _host_buckets = {}
+    _host_lock = threading.Lock()
+
+    def __init__(self, account_rate=None):
+        super(RateLimiter, self).__init__()
+        self.account = TokenBucket(account_rate)
+
+    @classmethod
+    def host_bucket(cls, url) -> TokenBucket:
+        host = urllib.parse.urlsplit(url).netloc
+        with cls._host_lock:
+            if host not in cls._host_buckets:
+                cls._host_buckets[host] = TokenBucket(cls.host_rate, burst=cls.host_burst)
+            return cls._host_buckets[host]
+
+    def set_account_rate(self, rate):
+        """requests per second of the account when it is not slowed down, None is unlimited"""
+        self.account.set_base_rate(rate)
+
+    def reserve(self, url, paced=True):
+        """seconds to wait before requesting url, paced=False skips the account bucket"""
+        wait = self.host_bucket(url).reserve()
+        if paced:
+            wait = max(wait, self.account.reserve())
+        return wait
+
+    def too_fast(self, url):
+        """the server answered 操作太快"""
+        self.account.slow_down()
+        zlogger.debug('slow down to {} requests/s'.format(self.account.rate))
+
+    def success(self, url):
+        self.account.speed_up()